@@ -1,11 +1,29 @@
-import pandas as pd
 import os
+import io
 import re
 import warnings
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.read_only import EMPTY_CELL
 from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.styles.colors import COLOR_INDEX
 import xlrd # Explicit import for PyInstaller hidden import
 import unicodedata
+import colorsys
+from xml.etree import ElementTree
+import hashlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import namedtuple
+from array import array
+from functools import partial
+from contextlib import contextmanager
+import time
+import tracemalloc
+from parse_cache import MemoryParseCache
+from export import is_export_file, write_export
 
 # Suppress openpyxl warnings if any
 warnings.filterwarnings("ignore")
@@ -35,355 +53,1596 @@ CONFIG = {
 }
 # ==============================================================================
 
-def process_files(input_files, output_file, target_year=None, attendance_file=None):
+# Use a process pool for parsing only when at least this many files are selected
+PARALLEL_MIN_FILES = 4
+
+# Bump when _read_comment_rows changes its output, so old parse-cache entries are not reused
+CACHE_FORMAT_VERSION = 2
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Archives: comment sheets inside a .zip are read straight from the archive
+ARCHIVE_EXTENSIONS = (".zip",)
+SHEET_EXTENSIONS = (".xlsx", ".xls")
+ATTENDANCE_PREFIX = "KogibetuSeiseki_"
+ZIP_MAX_MEMBER_BYTES = 256 * 1024 * 1024 # refuse members that unpack to more than this
+ZIP_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024 # ... and archives whose Excel members unpack to more than this
+
+# pandas is imported where it is used (attendance sheet, to_frame): it is the slowest
+# import by far, and the GUI window and every worker process start without it.
+
+# Rosters parsed in this process, by content hash (used when no parse cache is given)
+_ROSTER_MEMO = MemoryParseCache(max_bytes=32 * 1024 * 1024)
+
+class AggregationError(Exception):
     """
-    Reads selected Excel files, aggregates comments, and saves to output_file.
-    Filters by target_year if provided (checks Column C).
-    Sorts by attendance_file if provided (Col B=ID, Col C=Name).
+    A problem that stops the run. The message is shown to the user as-is.
     """
-    all_data = []
-    
-    print(f"Processing {len(input_files)} files...")
-    print(f"Target Year Filter: {target_year if target_year else 'None'}")
-    
-    attendance_ids_order = [] # List of IDs in order
-    attendance_map_name = {}  # ID -> Name (Kanji)
-    attendance_map_original_id = {} # NormID -> Original ID (for display)
-    attendance_name_map = {}  # Normalized Name (Kanji) -> ID (for fuzzy match)
-    if attendance_file:
-        print(f"Loading attendance sheet: {os.path.basename(attendance_file)}")
-        try:
-            # Read Attendance Sheet
-            skip_count = CONFIG["ATT_SKIP_ROWS"]
-            att_df = pd.read_excel(attendance_file, header=None)
-            
-            # Slice to skip rows
-            if len(att_df) > skip_count:
-                att_df = att_df.iloc[skip_count:]
-            else:
-                print(f"Attendance sheet has fewer than {skip_count + 1} rows.")
-                return False, "Attendance sheet is too short/empty."
-            
-            id_idx = CONFIG["ATT_COL_ID"]
-            name_idx = CONFIG["ATT_COL_NAME"]
 
-            for _, row in att_df.iterrows():
-                if pd.isna(row[id_idx]):
+def _normalize_name(name):
+    """
+    Normalizes a name for fuzzy matching.
+    NFKC converts full-width to half-width, then all whitespace is removed.
+    """
+    return _WHITESPACE_RE.sub('', unicodedata.normalize('NFKC', name))
+
+class NamePrefixIndex:
+    """
+    Prefix index (trie) over the normalized roster names.
+    match(name) returns the ID of the roster name that prefixes `name`,
+    choosing the earliest inserted one when several match - the same answer
+    as scanning the roster in order with startswith(), but in O(len(name)).
+    """
+    _END = "" # Trie node key marking "a roster name ends here" (never a character)
+
+    def __init__(self, name_map):
+        # name_map: Normalized Name -> ID, in roster order
+        self._root = {}
+        for order, (name, norm_id) in enumerate(name_map.items()):
+            node = self._root
+            for ch in name:
+                node = node.setdefault(ch, {})
+            node[self._END] = (order, norm_id)
+
+    def match(self, name):
+        best = None
+        node = self._root
+        for ch in name:
+            node = node.get(ch)
+            if node is None:
+                break
+            hit = node.get(self._END)
+            if hit is not None and (best is None or hit[0] < best[0]):
+                best = hit
+        return best[1] if best else None
+
+# ==============================================================================
+# PIPELINE STAGES
+# roster loader -> sheet reader -> record normalizer -> deduplicator -> pivot -> writer
+# Each stage is a plain function fed by the previous one (iterators where possible),
+# so stages can be reused, measured or replaced on their own (see Pipeline).
+# ==============================================================================
+
+class Roster:
+    """
+    Attendance sheet data used for matching and ordering students.
+    An empty Roster() means "no attendance sheet".
+    Rosters are shared between runs through the parse cache, so treat them as read-only.
+    """
+
+    def __init__(self, ids_order=(), names=None, original_ids=None, name_map=None):
+        self.ids_order = tuple(ids_order)       # NormIDs in sheet order
+        self.names = names or {}                # NormID -> Name (Kanji)
+        self.original_ids = original_ids or {}  # NormID -> Original ID (for display)
+        self.name_map = name_map or {}          # Normalized Name (Kanji) -> NormID (for fuzzy match)
+        self.name_index = NamePrefixIndex(self.name_map)
+
+    def __len__(self):
+        return len(self.ids_order)
+
+def as_source(obj):
+    """
+    Normalizes one input to a path, a (name, data) pair or a ZipMember.
+    Accepts a path, a (name, bytes / file object) pair, a ZipMember, or a file object
+    with a .name (e.g. a Streamlit upload). File objects are turned into bytes with
+    getvalue() when they have it (no copy for an untouched BytesIO), else read().
+    In-memory sources are picklable, so they can still be parsed in worker processes.
+    """
+    if isinstance(obj, (str, os.PathLike)):
+        return os.fspath(obj)
+    if isinstance(obj, ZipMember):
+        return obj
+    if isinstance(obj, tuple):
+        name, data = obj
+    else:
+        name, data = getattr(obj, "name", "upload.xlsx"), obj
+    if hasattr(data, "getvalue"):
+        data = data.getvalue()
+    elif hasattr(data, "read"):
+        data.seek(0)
+        data = data.read()
+    elif isinstance(data, memoryview):
+        data = data.tobytes()
+    return os.path.basename(str(name)), data
+
+def _source_name(source):
+    """
+    File name of a source, for dates and messages.
+    """
+    if isinstance(source, tuple):
+        return source[0]
+    if isinstance(source, ZipMember):
+        return source.name
+    return os.path.basename(source)
+
+def _open_source(source):
+    """
+    Something pandas / openpyxl can open: the path itself, or a BytesIO sharing the bytes
+    (for a ZipMember, the member unpacked now).
+    """
+    if isinstance(source, tuple):
+        return io.BytesIO(source[1])
+    if isinstance(source, ZipMember):
+        return io.BytesIO(source.read())
+    return source
+
+def load_roster(attendance_file, cache=None):
+    """
+    Stage 1: roster loader. Reads the attendance sheet (Col B=ID, Col C=Name).
+    Raises AggregationError if the sheet cannot be used.
+    cache: parse cache keyed by file content, so an unchanged attendance sheet is
+           parsed once (default: a small in-process cache).
+    """
+    attendance_file = as_source(attendance_file)
+    if cache is None:
+        cache = _ROSTER_MEMO
+    key = None
+    try:
+        key = _roster_cache_key(attendance_file)
+    except Exception:
+        pass # the read below reports the error
+    roster = cache.get(key) if key else None
+    if roster is not None:
+        print(f"Attendance sheet reused from parse cache: {_source_name(attendance_file)}")
+        return roster
+
+    roster = _parse_roster(attendance_file)
+    if key:
+        cache.put(key, roster)
+    return roster
+
+def _parse_roster(attendance_file):
+    """
+    Reads only the ID / Name columns below the header rows and builds the Roster
+    with vectorized string operations (no per-row Python loop).
+    """
+    import pandas as pd
+
+    print(f"Loading attendance sheet: {_source_name(attendance_file)}")
+    skip_count = CONFIG["ATT_SKIP_ROWS"]
+    id_idx = CONFIG["ATT_COL_ID"]
+    name_idx = CONFIG["ATT_COL_NAME"]
+    try:
+        # Read Attendance Sheet (object dtype keeps IDs as written, e.g. no "123.0")
+        att_df = pd.read_excel(_open_source(attendance_file), header=None, skiprows=skip_count,
+                               usecols=[id_idx, name_idx], dtype=object)
+    except Exception as e:
+        print(f"Error reading attendance sheet: {e}")
+        raise AggregationError(f"Error reading attendance sheet: {e}")
+
+    if att_df.empty:
+        print(f"Attendance sheet has fewer than {skip_count + 1} rows.")
+        raise AggregationError("Attendance sheet is too short/empty.")
+
+    try:
+        # usecols keeps the sheet's column order
+        cols = sorted({id_idx, name_idx})
+        id_series = att_df.iloc[:, cols.index(id_idx)]
+        name_series = att_df.iloc[:, cols.index(name_idx)]
+
+        keep = id_series.notna()
+        s_ids = id_series[keep].astype(str).str.strip()
+        s_names = name_series[keep].fillna("").astype(str).str.strip()
+
+        # Heuristic to skip headers
+        norm_ids = s_ids.str.lower()
+        keep = ~norm_ids.isin(["学籍番号", "id", "student id", "headerid", "number"])
+        s_ids, s_names, norm_ids = s_ids[keep].tolist(), s_names[keep], norm_ids[keep].tolist()
+
+        # Normalize Name for Fuzzy Matching (same as _normalize_name)
+        norm_names = s_names.str.normalize("NFKC").str.replace(_WHITESPACE_RE.pattern, "", regex=True).tolist()
+        s_names = s_names.tolist()
+
+        # Later rows win for repeated IDs / names, as in a row-by-row loop
+        names = dict(zip(norm_ids, s_names))
+        original_ids = dict(zip(norm_ids, s_ids))
+        name_map = {n: i for n, i in zip(norm_names, norm_ids) if n}
+    except Exception as e:
+        print(f"Error reading attendance sheet: {e}")
+        raise AggregationError(f"Error reading attendance sheet: {e}")
+
+    print(f"Loaded {len(norm_ids)} students from attendance sheet.")
+    return Roster(norm_ids, names, original_ids, name_map)
+
+# Theme color slots in the order Excel numbers them (theme=0 is lt1 / background 1)
+_THEME_SLOTS = ["lt1", "dk1", "lt2", "dk2", "accent1", "accent2", "accent3", "accent4", "accent5", "accent6", "hlink", "folHlink"]
+_DRAWINGML_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+
+def _theme_colors(theme_xml):
+    """
+    Returns the workbook theme colors as RGB hex strings, indexed like Color.theme.
+    """
+    if not theme_xml:
+        return []
+    try:
+        root = ElementTree.fromstring(theme_xml)
+    except ElementTree.ParseError:
+        return []
+    scheme = root.find(f".//{_DRAWINGML_NS}clrScheme")
+    if scheme is None:
+        return []
+    colors = []
+    for slot in _THEME_SLOTS:
+        rgb = None
+        el = scheme.find(_DRAWINGML_NS + slot)
+        if el is not None and len(el):
+            clr = el[0]
+            # srgbClr has val="RRGGBB"; sysClr (window / windowText) has lastClr
+            rgb = clr.get("val") if clr.tag == _DRAWINGML_NS + "srgbClr" else clr.get("lastClr")
+        colors.append(rgb.upper() if rgb else None)
+    return colors
+
+def _apply_tint(rgb, tint):
+    """
+    Lightens (tint > 0) or darkens (tint < 0) an RGB hex color the way Excel does (on HLS luminance).
+    """
+    if not tint:
+        return rgb
+    r, g, b = (int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    h, l, s = colorsys.rgb_to_hls(r, g, b)
+    l = l * (1 + tint) if tint < 0 else l * (1 - tint) + tint
+    return "".join("%02X" % round(v * 255) for v in colorsys.hls_to_rgb(h, l, s))
+
+class FillColorResolver:
+    """
+    Per-workbook fill color lookup for comment cells.
+    Each style id (read-only cells) / fill id (normal cells) is resolved once to an
+    ARGB hex or None, and later cells with the same style are served from a table.
+    RGB, theme (with tint) and indexed colors are resolved; white / transparent
+    fills are treated as "no color".
+    """
+
+    def __init__(self, wb):
+        self.wb = wb
+        self.theme = _theme_colors(wb.loaded_theme)
+        self.indexed = list(getattr(wb, "_colors", None) or COLOR_INDEX)
+        self.by_style_id = {}
+        self.by_fill_id = {}
+
+    def color(self, cell):
+        style_id = getattr(cell, "_style_id", None)
+        if style_id is not None:
+            # Read-only cell: style id -> cell style -> fill
+            if style_id not in self.by_style_id:
+                try:
+                    fill_id = self.wb._cell_styles[style_id].fillId
+                except IndexError:
+                    fill_id = None
+                self.by_style_id[style_id] = self.fill_color(fill_id)
+            return self.by_style_id[style_id]
+        style = getattr(cell, "_style", None) # normal cell (EmptyCell has no style)
+        return self.fill_color(style.fillId) if style is not None else None
+
+    def fill_color(self, fill_id):
+        if fill_id not in self.by_fill_id:
+            try:
+                fill = self.wb._fills[fill_id] if fill_id is not None else None
+            except IndexError:
+                fill = None
+            self.by_fill_id[fill_id] = self._resolve(fill)
+        return self.by_fill_id[fill_id]
+
+    def _resolve(self, fill):
+        if fill is None or getattr(fill, "patternType", None) != 'solid':
+            return None
+        fg = fill.start_color
+        fill_color = None
+        if fg.type == 'rgb':
+            fill_color = fg.rgb # e.g. "FFFF0000"
+        elif fg.type == 'theme':
+            if fg.theme is not None and fg.theme < len(self.theme) and self.theme[fg.theme]:
+                fill_color = "FF" + _apply_tint(self.theme[fg.theme], fg.tint)
+        elif fg.type == 'indexed':
+            if fg.indexed is not None and fg.indexed < len(self.indexed):
+                fill_color = "FF" + _apply_tint(self.indexed[fg.indexed][-6:], fg.tint)
+
+        # Store color if it looks like a valid highlight (not white/transparent)
+        if not isinstance(fill_color, str) or fill_color in ['00000000', 'FFFFFFFF', '00FFFFFF']:
+            return None
+        return fill_color
+
+def _xls_fill_colors(book):
+    """
+    Solid fill color (ARGB hex or None) for every XF (cell format) index of an .xls
+    workbook, computed once per workbook. Same white / transparent rule as .xlsx.
+    """
+    colors = []
+    for xf in book.xf_list:
+        fill_color = None
+        bg = xf.background
+        if bg.fill_pattern == 1: # solid
+            rgb = book.colour_map.get(bg.pattern_colour_index)
+            if rgb:
+                fill_color = "FF%02X%02X%02X" % rgb
+        if fill_color in ['00000000', 'FFFFFFFF', '00FFFFFF']:
+            fill_color = None
+        colors.append(fill_color)
+    return colors
+
+def _xls_cell_text(cell, datemode):
+    """
+    Cell value as the string openpyxl would give for the same cell in an .xlsx.
+    """
+    ctype, value = cell.ctype, cell.value
+    if ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK):
+        return ""
+    if ctype == xlrd.XL_CELL_NUMBER:
+        # .xls stores every number as a float; whole numbers read as int in .xlsx
+        return str(int(value)) if value.is_integer() else str(value)
+    if ctype == xlrd.XL_CELL_DATE:
+        return str(xlrd.xldate_as_datetime(value, datemode))
+    if ctype == xlrd.XL_CELL_BOOLEAN:
+        return str(bool(value))
+    if ctype == xlrd.XL_CELL_ERROR:
+        return xlrd.error_text_from_code.get(value, "")
+    return str(value)
+
+class SheetRows(list):
+    """
+    The raw rows of one sheet (a list, see _read_comment_rows).
+    rejected: rows with an ID or Name that a course filter dropped while parsing;
+    they were still read, so the run report counts them in rows_read.
+    """
+    rejected = 0
+
+def _read_xls_rows(source, row_filter=None):
+    """
+    .xls (BIFF) version of _read_comment_rows, same output.
+    Only the first sheet is loaded (on_demand) and fill colors come from the
+    per-XF color table instead of per-cell style lookups.
+    """
+    rows = SheetRows()
+
+    min_cols = CONFIG["MIN_COLS"]
+    sub_idx, course_idx, name_idx, id_idx, comment_idx = [CONFIG["COL_SUB_ID"], CONFIG["COL_COURSE"], CONFIG["COL_NAME"], CONFIG["COL_ID"], CONFIG["COL_COMMENT"]]
+
+    if isinstance(source, tuple):
+        book = xlrd.open_workbook(file_contents=source[1], on_demand=True, formatting_info=True)
+    elif isinstance(source, ZipMember):
+        book = xlrd.open_workbook(file_contents=source.read(), on_demand=True, formatting_info=True)
+    else:
+        book = xlrd.open_workbook(source, on_demand=True, formatting_info=True)
+    try:
+        ws_in = book.sheet_by_index(0)
+        # Rows are padded to the sheet width, so one check covers every row
+        if ws_in.ncols < min_cols:
+            return rows
+        fill_colors = _xls_fill_colors(book)
+        datemode = book.datemode
+
+        for r in range(ws_in.nrows):
+            name_col = _xls_cell_text(ws_in.cell(r, name_idx), datemode)
+            id_col   = _xls_cell_text(ws_in.cell(r, id_idx), datemode)
+
+            if not id_col.strip():
+                if not name_col.strip():
                     continue
-                
-                s_id = str(row[id_idx]).strip()
-                s_name = str(row[name_idx]).strip() if not pd.isna(row[name_idx]) else ""
-                
-                # Heuristic to skip headers
-                if s_id.lower() in ["学籍番号", "id", "student id", "headerid", "number"]:
+
+            course_col = _xls_cell_text(ws_in.cell(r, course_idx), datemode)
+            if row_filter is not None and not row_filter.accepts_course(course_col):
+                rows.rejected += 1
+                continue
+
+            sub_id_col = _xls_cell_text(ws_in.cell(r, sub_idx), datemode)
+            comment_col = _xls_cell_text(ws_in.cell(r, comment_idx), datemode)
+            fill_color = fill_colors[ws_in.cell_xf_index(r, comment_idx)]
+
+            rows.append((sub_id_col, course_col, name_col, id_col, comment_col, fill_color))
+    finally:
+        book.release_resources()
+
+    return rows
+
+def _read_comment_rows(source, streaming=True, row_filter=None):
+    """
+    Reads one comment sheet (path or (name, bytes) source) and returns its raw rows
+    as a SheetRows list. Each row is a tuple (SubID, Course, Name, ID, Comment, FillColor)
+    of strings (FillColor is an ARGB hex or None). Rows without both ID and Name are dropped.
+    This is a top-level function so it can run in a worker process.
+
+    streaming=True reads the sheet in openpyxl read-only mode, from the first column
+    named in CONFIG on, so memory stays at about one row instead of the whole sheet.
+    streaming=False loads the full workbook (slower, kept as a fallback).
+    row_filter: optional FilterSpec with a course filter; rows it rejects are counted
+    in SheetRows.rejected and skipped before their comment and color are converted.
+    .xls files are read by _read_xls_rows.
+    """
+    if _source_name(source).lower().endswith(".xls"):
+        return _read_xls_rows(source, row_filter)
+
+    rows = SheetRows()
+
+    min_cols = CONFIG["MIN_COLS"]
+    col_indices = [CONFIG["COL_SUB_ID"], CONFIG["COL_COURSE"], CONFIG["COL_NAME"], CONFIG["COL_ID"], CONFIG["COL_COMMENT"]]
+
+    # Use openpyxl to read data AND styles
+    wb_in = load_workbook(_open_source(source), read_only=streaming, data_only=True) # data_only=True gets values, but styles are on the cell
+    try:
+        ws_in = wb_in.active
+
+        if streaming:
+            # The <dimension> stored in the file may be missing or stale (openpyxl's write-only
+            # mode and some exporters always write "A1"), so it is ignored: rows are read
+            # unbounded and the sheet width is taken from the cells themselves.
+            ws_in.reset_dimensions()
+            # Cells left of the first CONFIG column are never created
+            first_col = min(col_indices)
+            row_iter = ws_in.iter_rows(min_col=first_col + 1)
+        else:
+            first_col = 0
+            row_iter = ws_in.iter_rows()
+
+        sub_idx, course_idx, name_idx, id_idx, comment_idx = [i - first_col for i in col_indices]
+        span = max(col_indices) + 1 - first_col
+        width = 0 # streaming: last column with a cell in any row so far
+        colors = FillColorResolver(wb_in)
+
+        # Extract values (converting to string same as pandas default roughly)
+        def get_val(cell):
+            return str(cell.value) if cell.value is not None else ""
+
+        for row in row_iter:
+            # Check sufficient columns (at least 7: A..G)
+            if not streaming and len(row) < min_cols:
+                continue
+            if streaming:
+                # Read-only rows end at their last cell; pad them to the CONFIG columns
+                if row:
+                    width = max(width, first_col + len(row))
+                if len(row) < span:
+                    row = tuple(row) + (EMPTY_CELL,) * (span - len(row))
+
+            name_col   = get_val(row[name_idx])
+            id_col     = get_val(row[id_idx])
+
+            if not id_col.strip(): 
+                if not name_col.strip(): 
                     continue
-                
-                # Store by normalized ID (lowercase)
-                norm_id = s_id.lower()
-                attendance_ids_order.append(norm_id)
-                attendance_map_name[norm_id] = s_name
-                attendance_map_original_id[norm_id] = s_id # Store original
-                
-                # Normalize Name for Fuzzy Matching
-                # NFKC converts full-width to half-width
-                # Then remove all whitespaces
-                norm_name = unicodedata.normalize('NFKC', s_name)
-                norm_name = re.sub(r'\s+', '', norm_name)
-                if norm_name:
-                    attendance_name_map[norm_name] = norm_id
-                
-            print(f"Loaded {len(attendance_ids_order)} students from attendance sheet.")
+
+            course_col = get_val(row[course_idx])
+            if row_filter is not None and not row_filter.accepts_course(course_col):
+                rows.rejected += 1
+                continue
+
+            sub_id_col = get_val(row[sub_idx])
+            comment_col = get_val(row[comment_idx])
             
-        except Exception as e:
-            print(f"Error reading attendance sheet: {e}")
-            return False, f"Error reading attendance sheet: {e}"
+            # Get Style from Comment Cell (only for rows that are kept)
+            fill_color = colors.color(row[comment_idx])
+
+            rows.append((sub_id_col, course_col, name_col, id_col, comment_col, fill_color))
+    finally:
+        # Read-only workbooks keep the file open until closed
+        wb_in.close()
+
+    # Like the full reader, a sheet narrower than 7 columns (A..G) yields no rows
+    if streaming and width < min_cols:
+        return SheetRows()
+    return rows
+
+def _content_hash(source):
+    """
+    sha256 hex digest of a source's bytes.
+    """
+    if isinstance(source, tuple):
+        return hashlib.sha256(source[1]).hexdigest()
+    h = hashlib.sha256()
+    with (source.open() if isinstance(source, ZipMember) else open(source, "rb")) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _cache_key(source):
+    """
+    Parse-cache key for a sheet: hash of the file content plus everything that
+    changes the extracted rows (reader version and CONFIG column indices).
+    """
+    layout = [CACHE_FORMAT_VERSION] + [CONFIG[k] for k in ("COL_SUB_ID", "COL_COURSE", "COL_NAME", "COL_ID", "COL_COMMENT", "MIN_COLS")]
+    return _content_hash(source) + "_" + "-".join(str(v) for v in layout)
+
+def _roster_cache_key(source):
+    """
+    Parse-cache key for an attendance sheet (content hash + attendance CONFIG).
+    """
+    layout = [CACHE_FORMAT_VERSION] + [CONFIG[k] for k in ("ATT_SKIP_ROWS", "ATT_COL_ID", "ATT_COL_NAME")]
+    return _content_hash(source) + "_roster-" + "-".join(str(v) for v in layout)
+
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
 
-    # Map to store comment colors: (NormID, Date) -> PatternFill object or color hex
-    # Storing hex string is easier for re-creating PatternFill
-    comment_colors = {} 
+def _date_from_filename(source):
+    """
+    Date column for a sheet: the YYYY-MM-DD in its filename, or the filename itself.
+    """
+    filename = _source_name(source)
+    date_match = _DATE_RE.search(filename)
+    return date_match.group(0) if date_match else filename
+
+class FilterSpec:
+    """
+    Which rows and files to aggregate. Every part is optional:
+      year          : Column C starts with this (the old target_year filter)
+      course_prefix : Column C starts with this (e.g. "2025前期 情報")
+      course_regex  : Column C matches this regular expression (re.search)
+      date_from / date_to : inclusive YYYY-MM-DD range of the file dates
+    The date range is checked against the date in each filename, so files outside
+    it are never opened (files without a date in their name are skipped too).
+    Course filters are checked on the course cell before the rest of the row is read.
+    Everywhere a target_year is accepted, a FilterSpec can be passed instead.
+    Raises ValueError for a malformed date or regular expression.
+    """
 
-    for file_path in input_files:
+    def __init__(self, year=None, course_prefix=None, course_regex=None, date_from=None, date_to=None):
+        self.year = str(year).strip() if year else None
+        self.course_prefix = course_prefix or None
         try:
-            filename = os.path.basename(file_path)
-            date_match = re.search(r'\d{4}-\d{2}-\d{2}', filename)
-            date_str = date_match.group(0) if date_match else filename
-            
-            # Use openpyxl to read data AND styles
-            wb_in = load_workbook(file_path, data_only=True) # data_only=True gets values, but styles are on the cell
-            ws_in = wb_in.active
-            
-            min_cols = CONFIG["MIN_COLS"]
+            self.course_regex = re.compile(course_regex) if course_regex else None
+        except re.error as e:
+            raise ValueError(f"Invalid course regular expression {course_regex!r}: {e}")
+        self.date_from = self._date(date_from)
+        self.date_to = self._date(date_to)
+
+    @staticmethod
+    def _date(value):
+        if not value:
+            return None
+        value = str(value)
+        if not _DATE_RE.fullmatch(value):
+            raise ValueError(f"Dates must be YYYY-MM-DD: {value}")
+        return value
+
+    @classmethod
+    def coerce(cls, value):
+        """
+        A FilterSpec from a target_year (str / int / None) or an existing FilterSpec.
+        """
+        return value if isinstance(value, cls) else cls(year=value)
+
+    def has_course_filter(self):
+        return bool(self.year or self.course_prefix or self.course_regex)
+
+    def has_date_filter(self):
+        return bool(self.date_from or self.date_to)
+
+    def __bool__(self):
+        return self.has_course_filter() or self.has_date_filter()
+
+    def accepts_course(self, course_col):
+        course = course_col.strip()
+        if self.year and not course.startswith(self.year):
+            return False
+        if self.course_prefix and not course.startswith(self.course_prefix):
+            return False
+        if self.course_regex and not self.course_regex.search(course):
+            return False
+        return True
+
+    def accepts_date(self, date_str):
+        if not self.has_date_filter():
+            return True
+        if not _DATE_RE.fullmatch(date_str):
+            return False
+        return (not self.date_from or date_str >= self.date_from) and (not self.date_to or date_str <= self.date_to)
+
+    def course_key(self):
+        """
+        Fingerprint of the course filters (part of the store's match key).
+        """
+        return repr((self.year, self.course_prefix, self.course_regex.pattern if self.course_regex else None))
+
+    def __str__(self):
+        if self.year and not (self.course_prefix or self.course_regex or self.has_date_filter()):
+            return self.year # same output as the plain year filter
+        parts = []
+        if self.year:
+            parts.append(f"year {self.year}")
+        if self.course_prefix:
+            parts.append(f"course starts with {self.course_prefix}")
+        if self.course_regex:
+            parts.append(f"course matches {self.course_regex.pattern}")
+        if self.has_date_filter():
+            parts.append(f"dates {self.date_from or '...'} to {self.date_to or '...'}")
+        return ", ".join(parts) if parts else "None"
+
+def prune_files(input_files, spec):
+    """
+    Drops the inputs whose filename date is outside spec's date range, without opening them.
+    Returns (kept sources, number skipped).
+    """
+    sources = [as_source(f) for f in input_files]
+    if not spec.has_date_filter():
+        return sources, 0
+    kept = [s for s in sources if spec.accepts_date(_date_from_filename(s))]
+    return kept, len(sources) - len(kept)
+
+def is_archive(obj):
+    """
+    True for a .zip input (path, (name, data) pair or file object), judged by its name.
+    """
+    if isinstance(obj, (str, os.PathLike)):
+        name = os.fspath(obj)
+    elif isinstance(obj, tuple):
+        name = obj[0]
+    else:
+        name = getattr(obj, "name", "")
+    return str(name).lower().endswith(ARCHIVE_EXTENSIONS)
+
+def _member_name(info):
+    """
+    File name of a zip member. Archives made by Windows Explorer store Japanese names
+    in cp932 without the UTF-8 flag, which zipfile decodes as cp437.
+    """
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode("cp437").decode("cp932")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return name
+
+class ZipMember:
+    """
+    An Excel file inside a .zip, unpacked only when it is read (see read_archive).
+    archive: path or in-memory source of the .zip
+    member: the member's name as zipfile lists it; path: its decoded path; name: its file name
+    Picklable, so members of an archive on disk are unpacked in the worker process that parses them.
+    """
+
+    def __init__(self, archive, member, path):
+        self.archive = archive
+        self.member = member
+        self.path = path
+        self.name = path.replace("\\", "/").rsplit("/", 1)[-1]
+
+    def __repr__(self):
+        return f"ZipMember({_source_name(self.archive)!r}, {self.path!r})"
+
+    @contextmanager
+    def open(self):
+        """
+        The member as a binary stream, read straight from the archive.
+        """
+        with zipfile.ZipFile(_open_source(self.archive)) as zf:
+            with zf.open(self.member) as f:
+                yield f
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+def read_archive(source):
+    """
+    Lists the Excel members of a .zip (path or in-memory source) without extracting it.
+    Returns ([ZipMember, ...] in member path order, attendance sheet ZipMember or None).
+    Nothing is unpacked here: each member is read when its sheet is parsed.
+    Members starting with KogibetuSeiseki_ are attendance sheets (the first one is returned).
+    Folders, Excel lock files (~$...) and macOS metadata are skipped.
+    Raises AggregationError if the archive cannot be read or unpacks to too much data
+    (ZIP_MAX_MEMBER_BYTES per member, ZIP_MAX_TOTAL_BYTES in total).
+    """
+    archive = _source_name(source)
+    sheets, rosters = [], []
+    total = 0
+    try:
+        with zipfile.ZipFile(_open_source(source)) as zf:
+            members = [(_member_name(info), info) for info in zf.infolist() if not info.is_dir()]
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError) as e:
+        print(f"Error processing {archive}: {e}")
+        raise AggregationError(f"Error processing {archive}: {e}")
+    for path, info in sorted(members, key=lambda m: m[0]):
+        member = ZipMember(source, info.filename, path)
+        if path.startswith("__MACOSX/") or member.name.startswith(("~$", "._")) or not member.name.lower().endswith(SHEET_EXTENSIONS):
+            continue
+        if info.file_size > ZIP_MAX_MEMBER_BYTES:
+            raise AggregationError(f"Error processing {archive}: {path} is too large ({info.file_size} bytes).")
+        if info.flag_bits & 0x1:
+            raise AggregationError(f"Error processing {archive}: {path} is password-protected.")
+        total += info.file_size
+        if total > ZIP_MAX_TOTAL_BYTES:
+            raise AggregationError(f"Error processing {archive}: the Excel files in it unpack to more than "
+                                   f"{ZIP_MAX_TOTAL_BYTES // (1024 * 1024)} MB.")
+        (rosters if member.name.startswith(ATTENDANCE_PREFIX) else sheets).append(member)
+    print(f"Archive {archive}: {len(sheets)} comment sheets" + (f", attendance sheet {rosters[0].name}" if rosters else ""))
+    return sheets, (rosters[0] if rosters else None)
+
+def expand_archives(input_files):
+    """
+    Replaces every .zip input by the comment sheets inside it (see read_archive).
+    Returns (sources, first attendance sheet found in an archive or None).
+    """
+    sources = []
+    attendance = None
+    for f in input_files:
+        source = as_source(f)
+        if not is_archive(source):
+            sources.append(source)
+            continue
+        sheets, roster = read_archive(source)
+        sources.extend(sheets)
+        if attendance is None:
+            attendance = roster
+    return sources, attendance
+
+def _sheet_error(source, e):
+    print(f"Error processing {source if isinstance(source, str) else _source_name(source)}: {e}")
+    return AggregationError(f"Error processing {_source_name(source)}: {str(e)}")
+
+def _pool_source(source):
+    """
+    What is sent to a worker process for a source. A member of an in-memory archive
+    is unpacked here, so the whole archive is not pickled once per member.
+    """
+    if isinstance(source, ZipMember) and isinstance(source.archive, tuple):
+        return source.name, source.read()
+    return source
+
+def read_sheets(input_files, workers=None, streaming=True, cache=None, row_filter=None):
+    """
+    Stage 2: sheet reader. Yields (source, date_str, rows) for every file, in input order.
+    input_files: paths and/or in-memory sources (see as_source).
+    Sheets are parsed in a worker process pool when there are enough files, and the
+    results are yielded in input order so the output matches the serial path exactly.
+    Raises AggregationError when a file cannot be read.
+    workers: number of worker processes (None = auto, 1 = no pool).
+    streaming: use the read-only sheet reader (False = load full workbooks).
+    cache: optional parse_cache.ParseCache; only files missing from it are parsed.
+    row_filter: optional FilterSpec whose course filter is applied while parsing
+                (see _read_comment_rows). Ignored when a cache is given: the cache keeps
+                every row, so a sheet is parsed once for any filter, and the normalizer
+                applies the course filter to the rows.
+    """
+    input_files = [as_source(f) for f in input_files]
+    if cache is not None or (row_filter is not None and not row_filter.has_course_filter()):
+        row_filter = None
+    ready = {} # index -> rows (cache hit) or Exception
+    keys = {}
+    todo = []  # indices of files that still need parsing
+
+    for i, file_path in enumerate(input_files):
+        if cache is not None:
+            try:
+                keys[i] = _cache_key(file_path)
+            except Exception as e: # unreadable file or archive member
+                ready[i] = e
+                continue
+            cached_rows = cache.get(keys[i])
+            if cached_rows is not None:
+                ready[i] = cached_rows
+                continue
+        todo.append(i)
+
+    if cache is not None:
+        print(f"Parse cache: {len(input_files) - len(todo)} of {len(input_files)} files reused.")
+
+    if workers is None:
+        # Starting a pool costs more than it saves for a handful of files
+        workers = (os.cpu_count() or 1) if len(todo) >= PARALLEL_MIN_FILES else 1
+    workers = max(1, min(workers, len(todo)))
+
+    pool = None
+    futures = {}
+    if workers > 1:
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            for i in todo:
+                futures[i] = pool.submit(_read_comment_rows, _pool_source(input_files[i]), streaming, row_filter)
+        except (OSError, NotImplementedError) as e:
+            # e.g. no multiprocessing support on this host -> fall back to serial
+            print(f"Process pool unavailable ({e}), reading files serially.")
+            futures = {}
+
+    try:
+        for i, file_path in enumerate(input_files):
+            if i in ready:
+                rows = ready.pop(i)
+            else:
+                rows = None
+                if i in futures:
+                    try:
+                        rows = futures.pop(i).result()
+                    except BrokenProcessPool as e:
+                        print(f"Process pool unavailable ({e}), reading files serially.")
+                        futures = {}
+                    except Exception as e:
+                        rows = e
+                if rows is None:
+                    try:
+                        rows = _read_comment_rows(file_path, streaming, row_filter)
+                    except Exception as e:
+                        rows = e
+                if cache is not None and i in keys and not isinstance(rows, Exception):
+                    cache.put(keys[i], rows)
+
+            if isinstance(rows, Exception):
+                raise _sheet_error(file_path, rows)
+            yield file_path, _date_from_filename(file_path), rows
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+# One kept comment row after matching it to a student (course: Column C, e.g. for sharding by section)
+Record = namedtuple('Record', ['norm_id', 'date', 'sub_id', 'name', 'id', 'comment', 'color', 'course'], defaults=[None])
+
+def normalize_records(sheets, roster, target_year=None, match_stats=None):
+    """
+    Stage 3: record normalizer. Turns raw sheet rows into Records.
+    Applies the target_year filter (Column C; a year or a FilterSpec) and matches each row to a student:
+    by ID first, then by the roster name prefix (fuzzy match).
+    match_stats: optional dict, counts of rows matched by "id", "name" or "unmatched".
+    """
+    if match_stats is None:
+        match_stats = {}
+    for key in ("id", "name", "unmatched"):
+        match_stats.setdefault(key, 0)
+
+    roster_names = roster.names
+    name_index = roster.name_index
+    spec = FilterSpec.coerce(target_year)
+    course_filter = spec.accepts_course if spec.has_course_filter() else None
+
+    for _, date_str, rows in sheets:
+        for sub_id_col, course_col, name_col, id_col, comment_col, fill_color in rows:
+            if course_filter is not None and not course_filter(course_col):
+                continue
             
-            for row in ws_in.iter_rows():
-                # Check sufficient columns (at least 7: A..G)
-                if len(row) < min_cols:
-                    continue
-                    
-                # Extract values (converting to string same as pandas default roughly)
-                def get_val(cell):
-                    return str(cell.value) if cell.value is not None else ""
-                
-                sub_id_col = get_val(row[CONFIG["COL_SUB_ID"]])
-                course_col = get_val(row[CONFIG["COL_COURSE"]])
-                name_col   = get_val(row[CONFIG["COL_NAME"]])
-                id_col     = get_val(row[CONFIG["COL_ID"]])
-                comment_col = get_val(row[CONFIG["COL_COMMENT"]])
-                
-                # Get Style from Comment Cell
-                comment_cell = row[CONFIG["COL_COMMENT"]]
-                fill_color = None
-                if comment_cell.fill and comment_cell.fill.patternType == 'solid':
-                    # Extract ARGB hex
-                    fg = comment_cell.fill.start_color
-                    if fg.type == 'rgb':
-                        fill_color = fg.rgb # e.g. "FFFF0000"
-                    elif fg.type == 'theme':
-                         # Theme colors are hard to resolve without theme map.
-                         # Often ignored, or we assume mapped manually?
-                         # For now, stick to RGB if available.
-                         # Many simple highlights are RGB.
-                         pass
-                    
-                    # Store color if it looks like a valid highlight (not white/transparent)
-                    # Default '00000000' or similar might appear.
-                    if fill_color and fill_color not in ['00000000', 'FFFFFFFF', '00FFFFFF']:
-                        pass
-                    else:
-                        fill_color = None
-
-                if not id_col.strip(): 
-                    if not name_col.strip(): 
-                        continue
-                
-                if target_year and not course_col.strip().startswith(str(target_year)):
-                    continue
-                
-                try:
-                    sub_id_val = float(sub_id_col)
-                except ValueError:
-                    sub_id_val = 0.0
+            try:
+                sub_id_val = float(sub_id_col)
+            except ValueError:
+                sub_id_val = 0.0
 
-                # 1. Primary Match: Normalize ID
-                norm_id = id_col.strip().lower()
+            # 1. Primary Match: Normalize ID
+            norm_id = id_col.strip().lower()
+            
+            # 2. Check if ID exists in Attendance
+            if norm_id in roster_names:
+                final_name = roster_names[norm_id]
+                match_stats["id"] += 1
+            else:
+                # 3. Fallback: Fuzzy Name Match
+                # Normalize Comment Name and look it up in the roster prefix index
+                c_name_norm = _normalize_name(name_col.strip())
+                found_id = name_index.match(c_name_norm)
                 
-                # 2. Check if ID exists in Attendance
-                if norm_id in attendance_map_name:
-                    final_name = attendance_map_name[norm_id]
+                if found_id:
+                    norm_id = found_id
+                    final_name = roster_names[found_id]
+                    match_stats["name"] += 1
                 else:
-                    # 3. Fallback: Fuzzy Name Match
-                    # Normalize Comment Name
-                    c_name_norm = unicodedata.normalize('NFKC', name_col.strip())
-                    c_name_norm = re.sub(r'\s+', '', c_name_norm)
-                    
-                    found_id = None
-                    for att_name_norm, att_id in attendance_name_map.items():
-                        if c_name_norm.startswith(att_name_norm):
-                            found_id = att_id
-                            break
-                    
-                    if found_id:
-                        norm_id = found_id
-                        final_name = attendance_map_name[found_id]
-                    else:
-                        final_name = name_col.strip()
-                
-                # Store Data
-                all_data.append({
-                    'SubmissionID': sub_id_val,
-                    'Name': final_name,
-                    'ID': id_col.strip(),
-                    'NormID': norm_id,
-                    'Date': date_str,
-                    'Comment': comment_col.strip()
-                })
-                
-                # Store Color if exists
-                if fill_color:
-                    # Key by (NormID, Date)
-                    # Note: Duplicates handled later, but we just store latest color for now is fine
-                    # Or store in all_data and pick during pivot?
-                    # Storing in a separate dict is tricky if multiple submissions.
-                    # Bester approach: add 'Color' to all_data, let deduplication handle it.
-                    all_data[-1]['Color'] = fill_color
+                    final_name = name_col.strip()
+                    match_stats["unmatched"] += 1
+            
+            yield Record(norm_id, date_str, sub_id_val, final_name, id_col.strip(), comment_col.strip(), fill_color,
+                         course_col.strip())
 
-        except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            return False, f"Error processing {os.path.basename(file_path)}: {str(e)}"
+UNANSWERED = "未回答" # Cell text for dates without a submission
 
-    if not all_data and not attendance_ids_order:
-        return False, "No data found."
+class StringPool:
+    """
+    Interns repeated strings (NormID, Name, Date, ...) into integer codes.
+    """
 
-    full_df = pd.DataFrame(all_data)
-    
-    # --- Deduplication Logic (same as before, but on NormID + Date) ---
-    if not full_df.empty:
-        full_df = full_df.sort_values(by=['NormID', 'Date', 'SubmissionID'], ascending=[True, True, True])
-        full_df = full_df.drop_duplicates(subset=['NormID', 'Date'], keep='last')
-    
-    # Extract Color Map after deduplication
-    color_map = {} # (Name, Date) or (NormID, Date) -> ColorHex
-                   # Wait, pivot uses NormID.
-    if not full_df.empty and 'Color' in full_df.columns:
-         for _, row in full_df.iterrows():
-             if not pd.isna(row['Color']):
-                 color_map[(row['NormID'], row['Date'])] = row['Color']
-
-    # Pivot
-    if not full_df.empty:
-        pivot_df = full_df.pivot_table(
-            index=['NormID'], 
-            columns='Date', 
-            values='Comment', 
-            aggfunc='last'
-        )
-    else:
-        pivot_df = pd.DataFrame()
-
-    # --- Sorting / Reindexing by ID ---
-    if attendance_ids_order:
-        # Reindex by Normalized ID
-        existing_ids = pivot_df.index.tolist() if not pivot_df.empty else []
-        extra_ids = [i for i in existing_ids if i not in attendance_ids_order]
-        full_order_ids = attendance_ids_order + extra_ids
-        
-        if not pivot_df.empty:
-            pivot_df = pivot_df.reindex(full_order_ids)
+    def __init__(self):
+        self.codes = {}  # string -> code
+        self.values = [] # code -> string
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+class SubmissionAccumulator:
+    """
+    Online deduplication: keeps only the latest submission (max SubmissionID)
+    per (NormID, Date) while rows stream in, instead of collecting every row
+    and sorting afterwards. On equal SubmissionIDs the later row wins.
+
+    Submissions are kept in columns, one slot per (NormID, Date) in first-seen order:
+    NormID / Name / ID / Date / Color / Course as interned integer codes, SubmissionID in a
+    float array and comments as UTF-8 in one packed buffer (offset + length per slot).
+    Replaced comments and removed slots stay as garbage until compact().
+    """
+
+    def __init__(self):
+        self.norm_ids = StringPool()
+        self.names = StringPool()
+        self.ids = StringPool()
+        self.dates = StringPool()
+        self.colors = StringPool()
+        self.courses = StringPool()
+        self.slots = {} # Date code -> {NormID code: slot}
+        self.count = 0  # live slots
+
+        self.live = bytearray() # 1 = slot in use, 0 = removed
+        self.norm_id_codes = array('i')
+        self.date_codes = array('i')
+        self.name_codes = array('i')
+        self.id_codes = array('i')
+        self.color_codes = array('i') # -1 = no color
+        self.course_codes = array('i') # -1 = unknown
+        self.sub_ids = array('d')
+        self.comment_offsets = array('q')
+        self.comment_lengths = array('i')
+        self.comment_data = bytearray()
+
+    def add(self, norm_id, date, sub_id, name, display_id, comment, color=None, course=None):
+        n = self.norm_ids.code(norm_id)
+        d = self.dates.code(date)
+        date_slots = self.slots.get(d)
+        if date_slots is None:
+            date_slots = self.slots[d] = {}
+        slot = date_slots.get(n)
+        if slot is not None and sub_id < self.sub_ids[slot]:
+            return
+        data = comment.encode('utf-8')
+        color_code = self.colors.code(color) if color is not None else -1
+        course_code = self.courses.code(course) if course is not None else -1
+        if slot is None:
+            date_slots[n] = len(self.sub_ids)
+            self.count += 1
+            self.live.append(1)
+            self.norm_id_codes.append(n)
+            self.date_codes.append(d)
+            self.name_codes.append(self.names.code(name))
+            self.id_codes.append(self.ids.code(display_id))
+            self.color_codes.append(color_code)
+            self.course_codes.append(course_code)
+            self.sub_ids.append(sub_id)
+            self.comment_offsets.append(len(self.comment_data))
+            self.comment_lengths.append(len(data))
         else:
-            pivot_df = pd.DataFrame(index=full_order_ids)
-            
-        pivot_df.index.name = 'NormID'
-        pivot_df = pivot_df.reset_index()
-        
-        # Restore Display Columns (Name, ID)
-        extras_map = {}
-        if not full_df.empty:
-            for _, row in full_df.iterrows():
-                extras_map[row['NormID']] = {'Name': row['Name'], 'ID': row['ID']}
-        
-        final_names = []
-        final_ids = []
-        
-        for nid in pivot_df['NormID']:
-            if nid in attendance_map_name:
-                final_names.append(attendance_map_name[nid]) 
-            elif nid in extras_map:
-                final_names.append(extras_map[nid]['Name']) 
+            self.name_codes[slot] = self.names.code(name)
+            self.id_codes[slot] = self.ids.code(display_id)
+            self.color_codes[slot] = color_code
+            self.course_codes[slot] = course_code
+            self.sub_ids[slot] = sub_id
+            self.comment_offsets[slot] = len(self.comment_data)
+            self.comment_lengths[slot] = len(data)
+        self.comment_data += data
+
+    def __len__(self):
+        return self.count
+
+    def comment(self, slot):
+        start = self.comment_offsets[slot]
+        return self.comment_data[start:start + self.comment_lengths[slot]].decode('utf-8')
+
+    def color(self, slot):
+        code = self.color_codes[slot]
+        return self.colors.values[code] if code >= 0 else None
+
+    def course(self, slot):
+        code = self.course_codes[slot]
+        return self.courses.values[code] if code >= 0 else None
+
+    def _entry(self, slot):
+        return (self.sub_ids[slot], self.names.values[self.name_codes[slot]], self.ids.values[self.id_codes[slot]],
+                self.comment(slot), self.color(slot))
+
+    def _live_slots(self):
+        live = self.live
+        return (slot for slot in range(len(live)) if live[slot])
+
+    def get(self, norm_id, date):
+        """
+        Returns (SubmissionID, Name, ID, Comment, Color) for (norm_id, date), or None.
+        """
+        d = self.dates.codes.get(date)
+        n = self.norm_ids.codes.get(norm_id)
+        if d is None or n is None:
+            return None
+        slot = self.slots.get(d, {}).get(n)
+        return self._entry(slot) if slot is not None else None
+
+    def items(self):
+        """
+        Yields ((NormID, Date), (SubmissionID, Name, ID, Comment, Color)) in first-seen order.
+        """
+        norm_ids, dates = self.norm_ids.values, self.dates.values
+        for slot in self._live_slots():
+            yield (norm_ids[self.norm_id_codes[slot]], dates[self.date_codes[slot]]), self._entry(slot)
+
+    def sorted_items(self):
+        """
+        Like items(), sorted by (NormID, Date). Only the keys are sorted; each entry
+        (and its comment) is decoded when it is yielded.
+        """
+        norm_ids, dates = self.norm_ids.values, self.dates.values
+        keys = sorted((norm_ids[self.norm_id_codes[slot]], dates[self.date_codes[slot]], slot)
+                      for slot in self._live_slots())
+        for norm_id, date, slot in keys:
+            yield (norm_id, date), self._entry(slot)
+
+    def records(self):
+        """
+        Yields every submission as a Record (incl. the course), in first-seen order.
+        add(*record) puts it back, e.g. into another accumulator.
+        """
+        norm_ids, dates = self.norm_ids.values, self.dates.values
+        for slot in self._live_slots():
+            yield Record(norm_ids[self.norm_id_codes[slot]], dates[self.date_codes[slot]], *self._entry(slot), self.course(slot))
+
+    def students(self):
+        """
+        Yields (NormID, Date, Name, ID) per submission without decoding comments.
+        """
+        norm_ids, dates = self.norm_ids.values, self.dates.values
+        names, ids = self.names.values, self.ids.values
+        for slot in self._live_slots():
+            yield (norm_ids[self.norm_id_codes[slot]], dates[self.date_codes[slot]],
+                   names[self.name_codes[slot]], ids[self.id_codes[slot]])
+
+    def remove_dates(self, dates):
+        """
+        Drops every submission of the given dates.
+        """
+        for date in dates:
+            d = self.dates.codes.get(date)
+            for slot in self.slots.pop(d, {}).values():
+                self.live[slot] = 0
+                self.count -= 1
+
+    def compact(self):
+        """
+        Rebuilds the columns without removed slots and replaced comments.
+        """
+        live = SubmissionAccumulator()
+        for record in self.records():
+            live.add(*record)
+        self.__dict__.update(live.__dict__)
+
+    def to_frame(self):
+        """
+        Returns the submissions as a DataFrame (NormID, ID, Name, Date, SubmissionID,
+        Comment, Color, Course) in first-seen order. Interned columns become categoricals
+        straight from their codes, without building a list of dicts.
+        """
+        import pandas as pd
+
+        slots = list(self._live_slots())
+        def categorical(codes, pool):
+            return pd.Categorical.from_codes([codes[s] for s in slots], categories=pool.values)
+        return pd.DataFrame({
+            "NormID": categorical(self.norm_id_codes, self.norm_ids),
+            "ID": categorical(self.id_codes, self.ids),
+            "Name": categorical(self.name_codes, self.names),
+            "Date": categorical(self.date_codes, self.dates),
+            "SubmissionID": [self.sub_ids[s] for s in slots],
+            "Comment": [self.comment(s) for s in slots],
+            "Color": categorical(self.color_codes, self.colors),
+            "Course": categorical(self.course_codes, self.courses),
+        })
+
+class SubmissionCells:
+    """
+    (NormID, Date) -> (Comment, Color) view of a SubmissionAccumulator, for SummaryTable.
+    Comments are decoded only when a cell is read.
+    """
+
+    def __init__(self, accumulator):
+        self.accumulator = accumulator
+
+    def get(self, key, default=None):
+        acc = self.accumulator
+        date_slots = acc.slots.get(acc.dates.codes.get(key[1]))
+        slot = date_slots.get(acc.norm_ids.codes.get(key[0])) if date_slots is not None else None
+        if slot is None:
+            return default
+        return acc.comment(slot), acc.color(slot)
+
+    def items(self):
+        for key, (_, _, _, comment, color) in self.accumulator.items():
+            yield key, (comment, color)
+
+def deduplicate(records, accumulator=None):
+    """
+    Stage 4: deduplicator. Feeds Records into a SubmissionAccumulator and returns it.
+    Pass an existing accumulator to add more records to it.
+    """
+    if accumulator is None:
+        accumulator = SubmissionAccumulator()
+    for rec in records:
+        accumulator.add(rec.norm_id, rec.date, rec.sub_id, rec.name, rec.id, rec.comment, rec.color, rec.course)
+    return accumulator
+
+class SummaryTable:
+    """
+    Sparse student x date summary handed to the writer.
+    rows: [(NormID, Name, ID), ...] in output order
+    dates: sorted date columns
+    cells: (NormID, Date) -> (Comment, Color) mapping (get / items); missing cells are "未回答".
+    submissions: the SubmissionAccumulator it was built from (for long-format export).
+    """
+
+    def __init__(self, rows, dates, cells, submissions=None):
+        self.rows = rows
+        self.dates = dates
+        self.cells = cells
+        self.submissions = submissions
+
+    def header(self):
+        return ['Name', 'ID'] + [str(d) for d in self.dates]
+
+    def iter_values(self):
+        """
+        Yields (NormID, [Name, ID, Comment1, Comment2, ...]) with "未回答" filled in.
+        """
+        for norm_id, values, _ in self.iter_rows():
+            yield norm_id, values
+
+    def iter_rows(self):
+        """
+        Like iter_values, plus the fill color (or None) of every date cell:
+        yields (NormID, [Name, ID, Comment1, ...], [Color1, ...]).
+        """
+        for norm_id, name, display_id in self.rows:
+            values = [name, display_id]
+            colors = []
+            for date in self.dates:
+                cell = self.cells.get((norm_id, date))
+                if cell is not None:
+                    values.append(cell[0])
+                    colors.append(cell[1])
+                else:
+                    values.append(UNANSWERED)
+                    colors.append(None)
+            yield norm_id, values, colors
+
+    def column_widths(self):
+        """
+        Longest text per column (header included), computed from the sparse cells.
+        """
+        widths = [max([len('Name')] + [len(str(r[1])) for r in self.rows]),
+                  max([len('ID')] + [len(str(r[2])) for r in self.rows])]
+        date_max = {d: len(str(d)) for d in self.dates}
+        date_count = dict.fromkeys(self.dates, 0)
+        # Rows can repeat (duplicate IDs in the attendance sheet); count each output row
+        row_repeats = {}
+        for r in self.rows:
+            row_repeats[r[0]] = row_repeats.get(r[0], 0) + 1
+        for (norm_id, date), (comment, _) in self.cells.items():
+            if norm_id in row_repeats:
+                date_max[date] = max(date_max[date], len(str(comment)))
+                date_count[date] += row_repeats[norm_id]
+        for d in self.dates:
+            if date_count[d] < len(self.rows):
+                date_max[d] = max(date_max[d], len(UNANSWERED))
+            widths.append(date_max[d])
+        return widths
+
+def build_summary(accumulator, roster=None):
+    """
+    Stage 5: pivot. Turns the deduplicated submissions into a SummaryTable.
+    With an attendance sheet: attendance order first, then other students sorted by NormID.
+    Without: all students sorted by NormID.
+    """
+    if roster is None:
+        roster = Roster()
+
+    first_seen = {} # NormID -> (Date, Name, ID) of the earliest date
+    last_seen = {}  # NormID -> (Date, Name, ID) of the latest date
+    dates = set()
+    for norm_id, date, name, display_id in accumulator.students():
+        dates.add(date)
+        if norm_id not in first_seen or date < first_seen[norm_id][0]:
+            first_seen[norm_id] = (date, name, display_id)
+        if norm_id not in last_seen or date > last_seen[norm_id][0]:
+            last_seen[norm_id] = (date, name, display_id)
+
+    dates = sorted(dates)
+    submitted_ids = sorted(first_seen)
+
+    rows = []
+    if roster.ids_order:
+        # --- Sorting by attendance order, extra students at the end ---
+        roster_ids = set(roster.ids_order)
+        extra_ids = [i for i in submitted_ids if i not in roster_ids]
+        for nid in [*roster.ids_order, *extra_ids]:
+            # Name / ID (Display) for students not in the attendance sheet: latest submission
+            extra = last_seen.get(nid)
+            if nid in roster.names:
+                name = roster.names[nid]
+            elif extra:
+                name = extra[1]
             else:
-                final_names.append("Unknown") 
-                
-            # ID (Display)
+                name = "Unknown"
             # Priority: Attendance Original ID > Comment Sheet Original ID > NormID
-            if nid in attendance_map_original_id:
-                final_ids.append(attendance_map_original_id[nid])
-            elif nid in extras_map:
-                final_ids.append(extras_map[nid]['ID'])
+            if nid in roster.original_ids:
+                display_id = roster.original_ids[nid]
+            elif extra:
+                display_id = extra[2]
             else:
-                 final_ids.append(nid) 
-                 
-        pivot_df.insert(0, 'Name', final_names)
-        pivot_df.insert(1, 'ID', final_ids)
-        
+                display_id = nid
+            rows.append((nid, name, display_id))
     else:
-        # No attendance sheet
-        if not full_df.empty:
-            pivot_df = pivot_df.reset_index() 
-            meta_df = full_df[['NormID', 'Name', 'ID']].drop_duplicates(subset=['NormID'])
-            pivot_df = pd.merge(pivot_df, meta_df, on='NormID', how='left')
+        # No attendance sheet: Name / ID from the earliest submission
+        for nid in submitted_ids:
+            _, name, display_id = first_seen[nid]
+            rows.append((nid, name, display_id))
+
+    return SummaryTable(rows, dates, SubmissionCells(accumulator), accumulator)
+
+def write_summary(output_file, table):
+    """
+    Stage 6: writer. Writes the summary sheet in a single pass (openpyxl write-only mode).
+    "未回答" fills, preserved comment colors and column widths are all
+    decided before writing, so the workbook is never reloaded and rows are streamed
+    to disk instead of being kept in memory.
+    """
+    wb = Workbook(write_only=True)
+    write_summary_sheet(wb.create_sheet("Sheet1"), table) # same sheet name as pandas to_excel
+    wb.save(output_file)
+
+def write_summary_sheet(ws, table):
+    """
+    Streams table into a new sheet of a write-only workbook (see write_summary).
+    """
+    # Adjust column widths (longest text + 2, max 50). Must be set before the first row.
+    for col_idx, max_length in enumerate(table.column_widths(), start=1):
+        adjusted_width = (max_length + 2)
+        if adjusted_width > 50:
+            adjusted_width = 50
+        ws.column_dimensions[get_column_letter(col_idx)].width = adjusted_width
+
+    # Header (Row 1)
+    ws.append(table.header())
+
+    # Define Fills
+    # Light Red for Unanswered
+    fill_unanswered = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
+    color_fills = {} # color hex -> PatternFill (None if the color is invalid)
+
+    # Columns: Name, ID, Date1, Date2...
+    for norm_id, values, colors in table.iter_rows():
+        row = values[:2]
+        for val, color_hex in zip(values[2:], colors):
+            fill = None
+            if str(val) == UNANSWERED:
+                fill = fill_unanswered
+            elif norm_id:
+                # Check for preserved color
+                if color_hex:
+                    if color_hex not in color_fills:
+                        try:
+                            color_fills[color_hex] = PatternFill(start_color=color_hex, end_color=color_hex, fill_type="solid")
+                        except:
+                            color_fills[color_hex] = None # formatting error
+                    fill = color_fills[color_hex]
+
+            if fill is None:
+                row.append(val)
+            else:
+                cell = WriteOnlyCell(ws, value=val)
+                cell.fill = fill
+                row.append(cell)
+        ws.append(row)
+
+class RunMetrics:
+    """
+    Per-file and per-stage numbers for one run.
+    Every event is passed to `callback` (if given) as a dict with an "event" key:
+      stage_start / stage_end  {"stage", "seconds", "peak_mb"}
+      file                     {"file", "date", "index", "total", "rows_read", "rows_kept", "fuzzy_hits", "seconds"}
+      report                   {"report": the structured run report, see report()}
+    rows_read counts every row with an ID or Name, including rows a course filter
+    dropped while parsing (SheetRows.rejected); rows_kept only the rows that passed it.
+    trace_memory=True records tracemalloc peaks (slows the run down noticeably).
+    """
+
+    def __init__(self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.files = []
+        self.stages = {}
+        self.totals = {}
+        self._inclusive = {} # stage -> seconds spent inside its iterator (incl. upstream stages)
+        self._start = time.perf_counter()
+
+    def emit(self, event, **data):
+        if self.callback is not None:
+            data["event"] = event
+            self.callback(data)
+
+    def peak_mb(self):
+        if self.trace_memory and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        return None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times a block as one stage (and its memory peak if tracing).
+        """
+        self.emit("stage_start", stage=name)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_stage(name, time.perf_counter() - start, self.peak_mb())
+
+    def record_stage(self, name, seconds, peak_mb=None):
+        self.stages[name] = {"seconds": seconds, "peak_mb": peak_mb}
+        self.emit("stage_end", stage=name, seconds=seconds, peak_mb=peak_mb)
+
+    def timed(self, iterable, name):
+        """
+        Wraps an iterator and adds the time spent producing its items to `name`.
+        Streaming stages run interleaved, so this is how their own time is measured.
+        """
+        self._inclusive.setdefault(name, 0.0)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._inclusive[name] += time.perf_counter() - start
+                return
+            self._inclusive[name] += time.perf_counter() - start
+            yield item
+
+    def track_files(self, sheets, match_stats, total):
+        """
+        Wraps the sheet iterator and reports each file once the normalizer has
+        consumed all of its rows (i.e. when the next file is requested).
+        """
+        current = None
+        last = time.perf_counter()
+        for index, (file_path, date_str, rows) in enumerate(sheets, start=1):
+            if current is not None:
+                last = self._file_done(current, match_stats, last)
+            current = {"file": _source_name(file_path), "date": date_str, "index": index,
+                       "total": total, "rows_read": len(rows) + getattr(rows, "rejected", 0),
+                       "_before": dict(match_stats)}
+            yield file_path, date_str, rows
+        if current is not None:
+            self._file_done(current, match_stats, last)
+
+    def _file_done(self, current, match_stats, last):
+        now = time.perf_counter()
+        before = current.pop("_before")
+        current["rows_kept"] = sum(match_stats[k] - before.get(k, 0) for k in match_stats)
+        current["fuzzy_hits"] = match_stats["name"] - before.get("name", 0)
+        current["seconds"] = now - last
+        self.files.append(current)
+        self.emit("file", **current)
+        return now
+
+    def streaming_stages(self, names, total_seconds, peak_mb=None):
+        """
+        Turns the nested iterator times of interleaved stages (e.g. read -> normalize -> deduplicate)
+        into the time spent in each stage itself.
+        """
+        previous = 0.0
+        for name in names[:-1]:
+            inclusive = self._inclusive.get(name, 0.0)
+            self.record_stage(name, inclusive - previous, peak_mb)
+            previous = inclusive
+        self.record_stage(names[-1], total_seconds - previous, peak_mb)
+
+    def report(self):
+        """
+        Structured run report: {"files": [...], "stages": {...}, "totals": {...}, "seconds": ...}
+        """
+        return {
+            "files": list(self.files),
+            "stages": dict(self.stages),
+            "totals": dict(self.totals),
+            "seconds": time.perf_counter() - self._start,
+        }
+
+CANCELLED = "Cancelled."
+
+def _until_cancelled(sheets, cancel):
+    """
+    Passes sheets through, checking cancel (a threading.Event) before each file is read.
+    """
+    sheets = iter(sheets)
+    while True:
+        if cancel.is_set():
+            raise AggregationError(CANCELLED)
+        try:
+            sheet = next(sheets)
+        except StopIteration:
+            return
+        yield sheet
+
+class Pipeline:
+    """
+    The aggregation as a chain of replaceable stages.
+    Every stage is an attribute, so one can be swapped without touching the others,
+    e.g. Pipeline(writer=my_writer).run(...). Defaults are the functions above.
+    """
+
+    def __init__(self, workers=None, streaming=True, cache=None, roster_loader=None, reader=None,
+                 normalizer=None, deduplicator=None, pivot=None, writer=None):
+        self.roster_loader = roster_loader or partial(load_roster, cache=cache)
+        self.reader = reader or partial(read_sheets, workers=workers, streaming=streaming, cache=cache)
+        self.normalizer = normalizer or normalize_records
+        self.deduplicator = deduplicator or deduplicate
+        self.pivot = pivot or build_summary
+        self.writer = writer # None = write_summary, or write_export for .csv / .parquet / .feather
+        self.last_report = None # run report of the latest run()
+
+    def aggregate(self, input_files, target_year=None, attendance_file=None, metrics=None, cancel=None):
+        """
+        Runs every stage except the writer and returns the SummaryTable.
+        input_files may include .zip archives of comment sheets; an attendance sheet
+        inside an archive is used when attendance_file is not given.
+        target_year: year string or FilterSpec. Files outside its date range are
+                     dropped before reading, its course filter is applied while parsing
+                     (or by the normalizer when the parse cache is used).
+        Raises AggregationError on failure.
+        metrics: optional RunMetrics that receives per-file and per-stage numbers.
+        cancel: optional threading.Event; when set, the run stops before the next file
+                with AggregationError(CANCELLED).
+        """
+        if metrics is None:
+            metrics = RunMetrics()
+
+        input_files, archive_attendance = expand_archives(input_files)
+        if not attendance_file and archive_attendance is not None:
+            print(f"Using the attendance sheet in the archive: {archive_attendance.name}")
+            attendance_file = archive_attendance
+
+        spec = FilterSpec.coerce(target_year)
+        input_files, skipped = prune_files(input_files, spec)
+        if skipped:
+            print(f"Date filter: skipped {skipped} files outside the date range.")
+
+        with metrics.stage("roster"):
+            roster = self.roster_loader(attendance_file) if attendance_file else Roster()
+
+        # How each kept row was matched to a student
+        match_stats = {"id": 0, "name": 0, "unmatched": 0}
+
+        # read -> normalize -> deduplicate run interleaved (streaming), timed per iterator
+        for name in ("read", "normalize", "deduplicate"):
+            metrics.emit("stage_start", stage=name)
+        start = time.perf_counter()
+        if spec.has_course_filter():
+            sheets = self.reader(input_files, row_filter=spec)
         else:
-             return False, "No data found."
-             
-    # Fill NaN
-    pivot_df = pivot_df.fillna("未回答")
-    
-    # Columns
-    if 'NormID' in pivot_df.columns:
-        # Keep NormID for Styling Map Lookup!
-        # pivot_df['NormID'] used for lookup
-        pass 
-    
-    # Reorder columns
-    cols = list(pivot_df.columns)
-    # NormID might be there. We need it for row-lookup during styling.
-    # But we shouldn't save it to file if we can avoid it.
-    # Or strict mapping: NormID is preserved in memory or we reconstruct map using (ID, Name)?
-    # Name/ID might be ambiguous? NormID is unique key.
-    # Let's keep NormID in DF, save without it, then reload? 
-    # Or iterate DF to apply style before saving?
-    # Pandas to_excel does not allow easy styling per cell during write.
-    # We have to write, then load with openpyxl.
-    # If we drop NormID, we lose the key.
-    # But wait, output rows correspond to `pivot_df` rows exactly.
-    # We can iterate `pivot_df` rows and apply style to Excel rows by index.
-    
-    # Final Columns for Output
-    # We want Name, ID, [Dates...]
-    # We should exclude NormID and Color from OUTPUT but use them for index tracking.
-    dates = [c for c in cols if c not in ['Name', 'ID', 'NormID']]
-    dates.sort()
-    output_cols = ['Name', 'ID'] + dates
-    
-    # Create final DF for saving
-    save_df = pivot_df[output_cols]
-    
-    print(f"Saving summary to {output_file}")
-    try:
-        save_df.to_excel(output_file, index=False)
-        
-        # 5. Styling
-        wb = load_workbook(output_file)
-        ws = wb.active
-        
-        # Define Fills
-        # Light Red for Unanswered
-        fill_unanswered = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
-        
-        # Iterate rows
-        # Row 1 is header. Data starts row 2.
-        # pivot_df index 0 corresponds to Excel Row 2.
-        
-        for idx, row_series in pivot_df.iterrows():
-            excel_row_idx = idx + 2
-            norm_id = row_series['NormID'] if 'NormID' in row_series else None
-            
-            # Iterate date columns
-            for col_offset, date_col in enumerate(dates):
-                # Columns: Name(1), ID(2), Date1(3), Date2(4)...
-                excel_col_idx = 3 + col_offset
-                cell = ws.cell(row=excel_row_idx, column=excel_col_idx)
-                
-                val = str(cell.value)
-                
-                if val == "未回答":
-                    cell.fill = fill_unanswered
-                else:
-                    # Check for preserved color
-                    if norm_id:
-                        color_hex = color_map.get((norm_id, date_col))
-                        if color_hex:
-                            try:
-                                cell.fill = PatternFill(start_color=color_hex, end_color=color_hex, fill_type="solid")
-                            except:
-                                pass # formatting error
-        
-        # Adjust column widths
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter # Get the column name
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            if adjusted_width > 50:
-                adjusted_width = 50
-            ws.column_dimensions[column].width = adjusted_width
-            
-        wb.save(output_file)
-        print("Done.")
-        return True, f"Saved to {os.path.basename(output_file)}"
-    except PermissionError:
-        return False, f"Permission denied: {output_file}. Close it and try again."
-    except Exception as e:
-        return False, f"Error saving file: {str(e)}"
+            sheets = self.reader(input_files)
+        sheets = metrics.timed(sheets, "read")
+        if cancel is not None:
+            sheets = _until_cancelled(sheets, cancel)
+        sheets = metrics.track_files(sheets, match_stats, len(input_files))
+        records = metrics.timed(self.normalizer(sheets, roster, spec, match_stats), "normalize")
+        submissions = self.deduplicator(records)
+        metrics.streaming_stages(["read", "normalize", "deduplicate"], time.perf_counter() - start, metrics.peak_mb())
+
+        metrics.totals.update({
+            "files": len(input_files),
+            "files_skipped": skipped,
+            "rows_read": sum(f["rows_read"] for f in metrics.files),
+            "rows_kept": sum(match_stats.values()),
+            "matched_by_id": match_stats["id"],
+            "fuzzy_hits": match_stats["name"],
+            "unmatched": match_stats["unmatched"],
+            "submissions": len(submissions),
+        })
+
+        if roster:
+            print(f"Matched rows: {match_stats['id']} by ID, {match_stats['name']} by name, {match_stats['unmatched']} not in attendance sheet.")
+
+        if not submissions and not roster:
+            raise AggregationError("No data found.")
+
+        # Pivot: sparse student x date table, "未回答" is filled in while writing
+        with metrics.stage("pivot"):
+            table = self.pivot(submissions, roster)
+        metrics.totals.update({"students": len(table.rows), "dates": len(table.dates)})
+        return table
+
+    def run(self, input_files, output_file, target_year=None, attendance_file=None, progress=None, trace_memory=False,
+            cancel=None):
+        """
+        Aggregates input_files and saves the summary. Returns (success, message).
+        progress: optional callback for RunMetrics events; the last event is the run report.
+        trace_memory: also record tracemalloc peaks per stage.
+        cancel: optional threading.Event checked between files (and before writing);
+                a cancelled run returns (False, CANCELLED) and writes nothing.
+        """
+        print(f"Processing {len(input_files)} files...")
+        print(f"Target Year Filter: {FilterSpec.coerce(target_year)}")
+
+        metrics = RunMetrics(progress, trace_memory)
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            success, message = self._run(input_files, output_file, target_year, attendance_file, metrics, cancel)
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+
+        report = metrics.report()
+        report.update({"success": success, "message": message})
+        self.last_report = report
+        metrics.emit("report", report=report)
+        return success, message
+
+    def _run(self, input_files, output_file, target_year, attendance_file, metrics, cancel):
+        try:
+            table = self.aggregate(input_files, target_year, attendance_file, metrics, cancel)
+        except AggregationError as e:
+            return False, str(e)
+        if cancel is not None and cancel.is_set():
+            return False, CANCELLED
+
+        # output_file may also be a binary file object (see process_buffers)
+        target = os.fspath(output_file) if isinstance(output_file, (str, os.PathLike)) else "memory"
+        print(f"Saving summary to {target}")
+        try:
+            writer = self.writer
+            if writer is None:
+                writer = write_export if is_export_file(output_file) else write_summary
+            with metrics.stage("write"):
+                writer(output_file, table)
+            print("Done.")
+            return True, f"Saved to {os.path.basename(target)}"
+        except PermissionError:
+            return False, f"Permission denied: {target}. Close it and try again."
+        except Exception as e:
+            return False, f"Error saving file: {str(e)}"
+
+def process_files(input_files, output_file, target_year=None, attendance_file=None, workers=None, streaming=True, cache=None,
+                  progress=None, trace_memory=False, cancel=None):
+    """
+    Reads selected Excel files, aggregates comments, and saves to output_file.
+    A .csv / .parquet / .feather output_file writes the unstyled summary plus the
+    long-format records next to it (see export.py) instead of the styled .xlsx.
+    input_files may include .zip archives; their sheets are read straight from the archive (see read_archive).
+    Filters by target_year if provided (checks Column C). Pass a FilterSpec instead
+    for course prefix / regex filters and a date range (checked on the filenames).
+    Sorts by attendance_file if provided (Col B=ID, Col C=Name).
+    workers: number of processes used to parse the sheets (None = auto, 1 = serial).
+    streaming: use the fast read-only sheet reader (False = load full workbooks).
+    cache: optional parse_cache.ParseCache (or MemoryParseCache) to reuse the rows of
+           unchanged files and the attendance roster between runs.
+    progress: optional callback(event_dict) for per-file / per-stage progress and the
+              final run report (see RunMetrics).
+    trace_memory: also measure tracemalloc peak memory per stage (slower).
+    cancel: optional threading.Event to stop the run between files (returns (False, CANCELLED)).
+    """
+    pipeline = Pipeline(workers=workers, streaming=streaming, cache=cache)
+    return pipeline.run(input_files, output_file, target_year, attendance_file, progress, trace_memory, cancel)
+
+def process_buffers(input_files, target_year=None, attendance_file=None, workers=None, streaming=True, cache=None,
+                    progress=None, trace_memory=False, cancel=None):
+    """
+    In-memory variant of process_files for uploaded files: nothing is written to disk.
+    input_files / attendance_file: (name, bytes) pairs or file objects with a .name
+    (see as_source). The date column still comes from each name.
+    Returns (success, message, BytesIO of the summary workbook or None).
+    """
+    output = io.BytesIO()
+    pipeline = Pipeline(workers=workers, streaming=streaming, cache=cache)
+    success, message = pipeline.run(input_files, output, target_year, attendance_file, progress, trace_memory, cancel)
+    if not success:
+        return False, message, None
+    output.seek(0)
+    return True, message, output
@@ -0,0 +1,206 @@
+import os
+import io
+import re
+import sys
+import time
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import aggregator
+import parse_cache
+import shard
+from aggregator import ATTENDANCE_PREFIX, SHEET_EXTENSIONS
+
+# ==============================================================================
+# Batch CLI (一括集計)
+# Aggregates many courses in one go: every folder under ROOT that contains
+# comment sheets is one course, and a "KogibetuSeiseki_" file in the same folder
+# is used as its attendance sheet. Courses run as jobs on one shared process
+# pool and one summary is written per course.
+#
+#   python src/batch_cli.py ROOT --year 2025
+#   python src/batch_cli.py ROOT --output-dir summaries --format csv --workers 8
+# ==============================================================================
+
+FORMATS = ["xlsx", "csv", "parquet", "feather"]
+DEFAULT_OUTPUT_DIR = "summaries"
+
+# Files written by earlier runs: <course>_summary.<fmt>, plus _long / shard files
+_SUMMARY_FILE_RE = re.compile(r'_summary(_[^.]*)?\.[^.]+$', re.IGNORECASE)
+
+class CourseJob:
+    """
+    One course folder: its comment sheets, attendance sheet (or None) and output file.
+    """
+
+    def __init__(self, name, folder, input_files, attendance_file, output_file):
+        self.name = name
+        self.folder = folder
+        self.input_files = input_files
+        self.attendance_file = attendance_file
+        self.output_file = output_file
+
+def find_courses(root, output_dir, fmt="xlsx"):
+    """
+    Walks root and returns a CourseJob for every folder with at least one comment sheet.
+    Excel lock files (~$...), the output folder, "summaries" folders and *_summary files
+    of earlier runs are skipped. If a folder has several attendance sheets, the first
+    one by name is used. Course names are unique (ignoring case, as on Windows): ROOT/a/b
+    and ROOT/a_b become "a_b" and "a_b_2", so no summary overwrites another.
+    """
+    jobs = []
+    used = set()
+    output_dir = os.path.abspath(output_dir)
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != DEFAULT_OUTPUT_DIR and
+                         os.path.abspath(os.path.join(folder, d)) != output_dir)
+
+        sheets = sorted(f for f in files if f.lower().endswith(SHEET_EXTENSIONS) and not f.startswith("~$")
+                        and not _SUMMARY_FILE_RE.search(f))
+        rosters = [f for f in sheets if f.startswith(ATTENDANCE_PREFIX)]
+        comment_sheets = [os.path.join(folder, f) for f in sheets if not f.startswith(ATTENDANCE_PREFIX)]
+        if not comment_sheets:
+            continue
+        if len(rosters) > 1:
+            print(f"Warning: several attendance sheets in {folder}, using {rosters[0]}")
+
+        rel = os.path.relpath(folder, root)
+        base = os.path.basename(os.path.abspath(root)) if rel == "." else rel.replace(os.sep, "_")
+        name, n = base, 2
+        while name.lower() in used:
+            name = f"{base}_{n}"
+            n += 1
+        used.add(name.lower())
+        jobs.append(CourseJob(
+            name,
+            folder,
+            comment_sheets,
+            os.path.join(folder, rosters[0]) if rosters else None,
+            os.path.join(output_dir, f"{name}_summary.{fmt}"),
+        ))
+    return jobs
+
+def run_course(job, target_year=None, cache_dir=None, writer=None):
+    """
+    Runs one course (in a worker process). Sheets are parsed serially inside the
+    job, since the pool already runs one course per CPU. target_year: year or FilterSpec.
+    writer: optional Pipeline writer (e.g. a shard.ShardedWriter).
+    Returns (name, success, message, run report, captured log).
+    """
+    cache = parse_cache.ParseCache(cache_dir) if cache_dir else None
+    pipeline = aggregator.Pipeline(workers=1, cache=cache, writer=writer)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        try:
+            success, message = pipeline.run(job.input_files, job.output_file, target_year, job.attendance_file)
+        except Exception as e:
+            success, message = False, f"Unexpected error: {e}"
+    return job.name, success, message, pipeline.last_report, log.getvalue()
+
+def run_batch(jobs, target_year=None, workers=None, cache_dir=None, verbose=False, writer=None):
+    """
+    Runs all jobs on one process pool (serially if no pool can be started).
+    Prints one line per finished course and returns [(job, success, message, report), ...]
+    in input order.
+    """
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+    results = {} # job index -> (job, success, message, report)
+
+    def finished(index, result):
+        job = jobs[index]
+        _, success, message, report, log = result
+        results[index] = (job, success, message, report)
+        seconds = report["seconds"] if report else 0
+        rows = report["totals"].get("rows_read", 0) if report else 0
+        status = "OK  " if success else "FAIL"
+        print(f"[{len(results)}/{len(jobs)}] {status} {job.name}: {len(job.input_files)} files, {rows} rows, {seconds:.1f} s - {message}")
+        if verbose or not success:
+            print("    " + log.rstrip().replace("\n", "\n    "))
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(run_course, job, target_year, cache_dir, writer): i for i, job in enumerate(jobs)}
+                for future in as_completed(futures):
+                    finished(futures[future], future.result())
+        except (OSError, NotImplementedError, BrokenProcessPool) as e:
+            print(f"Process pool unavailable ({e}), running the remaining courses serially.")
+
+    for i, job in enumerate(jobs):
+        if i not in results:
+            finished(i, run_course(job, target_year, cache_dir, writer))
+
+    return [results[i] for i in range(len(jobs))]
+
+def print_report(results, seconds):
+    """
+    Prints the throughput summary of a batch run.
+    """
+    courses = len(results)
+    failed = [job.name for job, success, _, _ in results if not success]
+    files = sum(len(job.input_files) for job, _, _, _ in results)
+    rows = sum(report["totals"].get("rows_read", 0) for _, _, _, report in results if report)
+    submissions = sum(report["totals"].get("submissions", 0) for _, _, _, report in results if report)
+
+    print("\n== Batch report ==")
+    print(f"Courses    : {courses} ({courses - len(failed)} OK, {len(failed)} failed)")
+    print(f"Files      : {files}")
+    print(f"Rows read  : {rows}  ({submissions} submissions)")
+    print(f"Wall time  : {seconds:.1f} s")
+    if seconds > 0:
+        print(f"Throughput : {files / seconds:.1f} files/s, {rows / seconds:,.0f} rows/s, {courses / seconds * 60:.1f} courses/min")
+    if failed:
+        print("Failed     : " + ", ".join(failed))
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description="Aggregate every course folder under ROOT / コースフォルダを一括集計")
+    parser.add_argument("root", help="Folder containing one sub-folder per course")
+    parser.add_argument("--output-dir", default=None, help="Where summaries are written (default: ROOT/summaries)")
+    parser.add_argument("--year", default=None, help="Target year filter (Column C)")
+    parser.add_argument("--course-prefix", default=None, help="Only rows whose Column C starts with this")
+    parser.add_argument("--course-regex", default=None, help="Only rows whose Column C matches this regular expression")
+    parser.add_argument("--from", dest="date_from", default=None, help="First date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--to", dest="date_to", default=None, help="Last date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--format", choices=FORMATS, default="xlsx", help="Output format (default: xlsx)")
+    parser.add_argument("--shard", default=None,
+                        help="Split the .xlsx summary: students[:N] (every N students), month or section")
+    parser.add_argument("--shard-mode", choices=shard.SHARD_MODES, default="sheets",
+                        help="One sheet per shard (default) or one workbook per shard")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--cache", action="store_true", help="Reuse the per-user parse cache between runs")
+    parser.add_argument("--verbose", action="store_true", help="Print each course's log")
+    args = parser.parse_args()
+    try:
+        spec = aggregator.FilterSpec(args.year, args.course_prefix, args.course_regex, args.date_from, args.date_to)
+    except ValueError as e:
+        parser.error(str(e))
+    writer = None
+    if args.shard:
+        if args.format != "xlsx":
+            parser.error("--shard only applies to --format xlsx")
+        try:
+            by, size = shard.parse_shard_option(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        # Courses already run one per CPU, so each course writes its shards serially
+        writer = shard.ShardedWriter(by, size, args.shard_mode, workers=1)
+
+    output_dir = args.output_dir or os.path.join(args.root, DEFAULT_OUTPUT_DIR)
+    jobs = find_courses(args.root, output_dir, args.format)
+    if not jobs:
+        print(f"No comment sheets found under {args.root}")
+        sys.exit(1)
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Found {len(jobs)} courses under {args.root}, writing summaries to {output_dir}")
+
+    cache_dir = parse_cache.default_cache_dir() if args.cache else None
+    start = time.perf_counter()
+    results = run_batch(jobs, spec, args.workers, cache_dir, args.verbose, writer)
+    print_report(results, time.perf_counter() - start)
+
+    sys.exit(0 if all(success for _, success, _, _ in results) else 1)
@@ -0,0 +1,295 @@
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+import subprocess
+
+import aggregator
+import parse_cache
+import generate_test_data
+
+# ==============================================================================
+# Benchmark (ベンチマーク)
+# Times process_files end to end and stage by stage on synthetic courses,
+# records peak memory, and compares against saved baseline results.
+#
+#   python src/benchmark.py --scenario medium --save-baseline bench_baseline.json
+#   python src/benchmark.py --scenario medium --compare bench_baseline.json
+#   python src/benchmark.py --import-time   (cold-start import time of the apps)
+# ==============================================================================
+
+SCENARIOS = {
+    "small":  dict(students=20, days=5, attendance_size=20),
+    "medium": dict(students=300, days=30, typo_rate=0.02, fill_rate=0.05, attendance_size=320),
+    "large":  dict(students=2000, days=120, typo_rate=0.02, fill_rate=0.05, attendance_size=2100),
+}
+
+STAGES = ["roster", "read", "normalize", "deduplicate", "pivot", "write"]
+
+# Timings / peak memory below these are too noisy to flag as regressions
+MIN_SECONDS = 0.05
+MIN_PEAK_MB = 5.0
+
+# Modules whose cold-start import time --import-time measures
+IMPORT_TARGETS = ["gui_app", "streamlit_app", "aggregator"]
+
+def prepare_data(scenario, data_root):
+    """
+    Generates the scenario's sheets once and reuses them on later runs.
+    Returns (comment sheet paths, attendance path).
+    """
+    params = dict(SCENARIOS[scenario], seed=0)
+    data_dir = os.path.join(data_root, scenario)
+    marker = os.path.join(data_dir, "params.json")
+
+    if os.path.exists(marker):
+        with open(marker, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["params"] == params and saved.get("version") == generate_test_data.DATA_VERSION:
+            return saved["files"], saved["attendance"]
+
+    print(f"Generating '{scenario}' data in {data_dir} ...")
+    with contextlib.redirect_stdout(io.StringIO()):
+        files, attendance = generate_test_data.generate(data_dir, **params)
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "version": generate_test_data.DATA_VERSION, "files": files,
+                   "attendance": attendance}, f)
+    return files, attendance
+
+def run_end_to_end(files, attendance, output_file, workers=None, trace_memory=False):
+    """
+    Runs process_files once. Returns (seconds, peak MB or None).
+    Peak memory is the main process only (tracemalloc does not see worker processes).
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        success, message = aggregator.process_files(files, output_file, None, attendance, workers=workers)
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    if not success:
+        raise RuntimeError(message)
+    return seconds, peak
+
+def run_stages(files, attendance, output_file, workers=None):
+    """
+    Runs each pipeline stage on its own (materializing the iterators in between).
+    Stages are run twice: once for time, once under tracemalloc for peak memory
+    (tracemalloc slows Python code down too much to time with it).
+    Returns {stage: {"seconds": ..., "peak_mb": ...}}.
+    """
+    results = {stage: {} for stage in STAGES}
+
+    for trace_memory in (False, True):
+        def measure(stage, func):
+            if trace_memory:
+                tracemalloc.reset_peak()
+                value = func()
+                results[stage]["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            else:
+                start = time.perf_counter()
+                value = func()
+                results[stage]["seconds"] = time.perf_counter() - start
+            return value
+
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                # A fresh cache, so the roster is really parsed (not reused from an earlier run)
+                roster = measure("roster", lambda: aggregator.load_roster(attendance, parse_cache.MemoryParseCache()) if attendance else aggregator.Roster())
+                sheets = measure("read", lambda: list(aggregator.read_sheets(files, workers=workers)))
+                records = measure("normalize", lambda: list(aggregator.normalize_records(sheets, roster)))
+                submissions = measure("deduplicate", lambda: aggregator.deduplicate(records))
+                table = measure("pivot", lambda: aggregator.build_summary(submissions, roster))
+                measure("write", lambda: aggregator.write_summary(output_file, table))
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+
+    results["_rows"] = {"sheet_rows": sum(len(rows) for _, _, rows in sheets), "records": len(records), "submissions": len(submissions)}
+    return results
+
+def run_benchmark(scenario, data_root, workers=None, repeat=1):
+    files, attendance = prepare_data(scenario, data_root)
+    with tempfile.TemporaryDirectory() as tmp:
+        output_file = os.path.join(tmp, "summary.xlsx")
+
+        # Timing without tracemalloc (it slows Python code down), best of `repeat`
+        times = [run_end_to_end(files, attendance, output_file, workers)[0] for _ in range(repeat)]
+        _, peak = run_end_to_end(files, attendance, output_file, workers=1, trace_memory=True)
+        stages = run_stages(files, attendance, output_file, workers)
+
+    counts = stages.pop("_rows")
+    return {
+        "scenario": scenario,
+        "params": SCENARIOS[scenario],
+        "files": len(files),
+        "workers": workers,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "end_to_end_seconds": min(times),
+        "end_to_end_peak_mb": peak,
+        "stages": stages,
+        **counts,
+    }
+
+def measure_import(module, repeat=3):
+    """
+    Imports `module` in fresh interpreters with python -X importtime, best of `repeat`.
+    Returns {"module", "seconds" (import), "wall_seconds" (incl. interpreter start),
+    "heaviest": [[name, seconds], ...] of its direct imports} or {"module", "error"}.
+    """
+    src = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=src, capture_output=True, text=True, encoding="utf-8", errors="replace")
+        wall = time.perf_counter() - start
+        if proc.returncode != 0:
+            errors = [l for l in proc.stderr.splitlines() if l.strip() and not l.startswith("import time:")]
+            return {"module": module, "error": errors[-1] if errors else f"exit code {proc.returncode}"}
+        if best is None or wall < best[0]:
+            best = (wall, proc.stderr)
+
+    # Lines are "import time: self [us] | cumulative [us] | <2 spaces per nesting level>name",
+    # children are listed before their parent
+    children = []
+    seconds = None
+    for line in best[1].splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        cumulative = int(parts[1]) / 1e6
+        if depth == 0:
+            if name.strip() == module:
+                seconds = cumulative
+                break
+            children = []
+        elif depth == 1:
+            children.append([name.strip(), cumulative])
+    children.sort(key=lambda c: -c[1])
+    return {"module": module, "seconds": seconds, "wall_seconds": best[0], "heaviest": children[:5]}
+
+def run_import_times(modules=None, repeat=3):
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "imports": [measure_import(m, repeat) for m in modules or IMPORT_TARGETS],
+    }
+
+def print_import_times(result):
+    print("\n== Import time (cold start, best of runs) ==")
+    for entry in result["imports"]:
+        if "error" in entry:
+            print(f"  {entry['module']:<14}: not importable here ({entry['error']})")
+            continue
+        print(f"  {entry['module']:<14}: {entry['seconds']:6.3f} s import, {entry['wall_seconds']:6.3f} s incl. interpreter start")
+        print("      " + ", ".join(f"{name} {sec:.3f} s" for name, sec in entry["heaviest"]))
+
+def print_result(result):
+    print(f"\n== {result['scenario']}: {result['files']} files, {result['sheet_rows']} rows, {result['submissions']} submissions ==")
+    rows_per_sec = result["sheet_rows"] / result["end_to_end_seconds"] if result["end_to_end_seconds"] else 0
+    print(f"End to end : {result['end_to_end_seconds']:8.2f} s  ({rows_per_sec:,.0f} rows/s)  peak {result['end_to_end_peak_mb']:.1f} MB (serial, main process)")
+    for stage in STAGES:
+        st = result["stages"][stage]
+        print(f"  {stage:<11}: {st['seconds']:8.3f} s  peak {st['peak_mb']:8.1f} MB")
+
+def _metrics(result):
+    """
+    Flat {name: value} of the numbers compared against a baseline.
+    """
+    if "imports" in result:
+        return {f"{e['module']}.import_seconds": e["seconds"] for e in result["imports"] if "error" not in e}
+    metrics = {"end_to_end_seconds": result["end_to_end_seconds"], "end_to_end_peak_mb": result["end_to_end_peak_mb"]}
+    for stage, st in result["stages"].items():
+        metrics[f"{stage}.seconds"] = st["seconds"]
+        metrics[f"{stage}.peak_mb"] = st["peak_mb"]
+    return metrics
+
+def compare(result, baseline, tolerance):
+    """
+    Prints current vs baseline for every metric. Returns True if nothing regressed
+    by more than `tolerance` (0.2 = 20 %).
+    """
+    ok = True
+    current = _metrics(result)
+    previous = _metrics(baseline)
+    print(f"\n-- compared with baseline ({baseline.get('python')}, {baseline.get('machine')}) --")
+    for name, value in current.items():
+        before = previous.get(name)
+        if not before or value is None:
+            continue
+        ratio = value / before
+        flag = ""
+        if name.endswith("seconds") and max(value, before) < MIN_SECONDS:
+            pass
+        elif name.endswith("peak_mb") and max(value, before) < MIN_PEAK_MB:
+            pass
+        elif ratio > 1 + tolerance:
+            flag = "  <-- REGRESSION"
+            ok = False
+        print(f"  {name:<24} {before:10.3f} -> {value:10.3f}  x{ratio:5.2f}{flag}")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comment aggregator benchmark / ベンチマーク")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append",
+                        help="Scenario to run (repeatable, default: small and medium)")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "ksgadget_bench"),
+                        help="Where generated data is kept between runs")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: auto)")
+    parser.add_argument("--repeat", type=int, default=3, help="End-to-end runs, best time is kept")
+    parser.add_argument("--save-baseline", metavar="FILE", help="Store the results as the new baseline")
+    parser.add_argument("--compare", metavar="FILE", help="Compare against a stored baseline")
+    parser.add_argument("--import-time", action="store_true",
+                        help="Measure cold-start import time of the GUI / web app (runs no scenario unless --scenario is given)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    baselines = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    results = {}
+    all_ok = True
+    if args.import_time:
+        result = run_import_times(repeat=args.repeat)
+        results["imports"] = result
+        print_import_times(result)
+        if "imports" in baselines:
+            all_ok = compare(result, baselines["imports"], args.tolerance) and all_ok
+
+    scenarios = args.scenario or ([] if args.import_time else ["small", "medium"])
+    for scenario in scenarios:
+        result = run_benchmark(scenario, args.data_dir, args.workers, args.repeat)
+        results[scenario] = result
+        print_result(result)
+        if scenario in baselines:
+            all_ok = compare(result, baselines[scenario], args.tolerance) and all_ok
+
+    if args.save_baseline:
+        saved = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, encoding="utf-8") as f:
+                saved = json.load(f)
+        saved.update(results)
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(saved, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    sys.exit(0 if all_ok else 1)
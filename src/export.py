@@ -0,0 +1,107 @@
+import os
+import csv
+
+# ==============================================================================
+# Columnar export (CSV / Parquet / Feather)
+# For large cohorts the styled .xlsx is slow to write and to open, and is often
+# loaded back into pandas anyway. These writers skip the styling entirely and
+# write two tables next to each other:
+#   <output>           : the summary (Name, ID, one column per date, "未回答" filled in)
+#   <output>_long.<ext>: one row per deduplicated submission
+#                        (NormID, ID, Name, Date, SubmissionID, Comment, Color)
+# The format is chosen by the output extension. Parquet / Feather need pyarrow
+# (optional: pip install pyarrow); CSV works everywhere.
+# ==============================================================================
+
+LONG_COLUMNS = ["NormID", "ID", "Name", "Date", "SubmissionID", "Comment", "Color"]
+
+CSV_EXTENSIONS = (".csv",)
+ARROW_EXTENSIONS = (".parquet", ".feather")
+EXPORT_EXTENSIONS = CSV_EXTENSIONS + ARROW_EXTENSIONS
+
+def is_export_file(output_file):
+    """
+    True if output_file should be written by write_export instead of as styled .xlsx.
+    """
+    return isinstance(output_file, (str, os.PathLike)) and \
+        os.path.splitext(os.fspath(output_file))[1].lower() in EXPORT_EXTENSIONS
+
+def long_path(output_file):
+    """
+    Path of the long-format table written next to the summary.
+    """
+    base, ext = os.path.splitext(os.fspath(output_file))
+    return f"{base}_long{ext}"
+
+def iter_long_records(table):
+    """
+    Yields one LONG_COLUMNS row per deduplicated submission, sorted by (NormID, Date).
+    Needs table.submissions (the SubmissionAccumulator the table was built from).
+    """
+    if table.submissions is None:
+        raise ValueError("Long-format export needs the submissions behind the summary (table.submissions is None).")
+    for (norm_id, date), (sub_id, name, display_id, comment, color) in table.submissions.sorted_items():
+        yield [norm_id, display_id, name, date, sub_id, comment, color or ""]
+
+def write_csv(output_file, table):
+    """
+    Streams the summary and the long records to CSV (UTF-8 with BOM so Excel
+    shows Japanese text correctly). Rows are written as they are produced.
+    """
+    with open(output_file, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(table.header())
+        for _, values in table.iter_values():
+            writer.writerow(values)
+
+    with open(long_path(output_file), "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(LONG_COLUMNS)
+        writer.writerows(iter_long_records(table))
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet / Feather export needs pyarrow (pip install pyarrow). CSV works without it.")
+    return pyarrow
+
+def write_arrow(output_file, table):
+    """
+    Writes the summary and the long records as Parquet or Feather (by extension).
+    Columns are built directly from the table, no DataFrame in between.
+    """
+    pa = _import_pyarrow()
+
+    header = table.header()
+    columns = [[] for _ in header]
+    for _, values in table.iter_values():
+        for column, value in zip(columns, values):
+            column.append(str(value))
+    summary = pa.table([pa.array(c, type=pa.string()) for c in columns], names=header)
+
+    long_columns = [[] for _ in LONG_COLUMNS]
+    for record in iter_long_records(table):
+        for column, value in zip(long_columns, record):
+            column.append(value)
+    types = [pa.string()] * len(LONG_COLUMNS)
+    types[LONG_COLUMNS.index("SubmissionID")] = pa.float64()
+    long_table = pa.table([pa.array(c, type=t) for c, t in zip(long_columns, types)], names=LONG_COLUMNS)
+
+    if os.fspath(output_file).lower().endswith(".parquet"):
+        write = pa.parquet.write_table
+    else:
+        write = pa.feather.write_feather
+    write(summary, output_file)
+    write(long_table, long_path(output_file))
+
+def write_export(output_file, table):
+    """
+    Pipeline writer for .csv / .parquet / .feather outputs.
+    """
+    if os.fspath(output_file).lower().endswith(CSV_EXTENSIONS):
+        write_csv(output_file, table)
+    else:
+        write_arrow(output_file, table)
@@ -1,72 +1,121 @@
-import pandas as pd
 import os
 import random
+import argparse
 from datetime import datetime, timedelta
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
 
-# Configuration
-INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'input')
+# Configuration (defaults, all can be changed on the command line)
+INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'input')
 NUM_STUDENTS = 20
 NUM_DAYS = 5
+# Bump when the same parameters produce different sheets (benchmark data is regenerated)
+DATA_VERSION = 2
 
-# Ensure input directory exists
-os.makedirs(INPUT_DIR, exist_ok=True)
-
-# Generate dummy students
-students = []
-for i in range(NUM_STUDENTS):
-    students.append({
-        'name': f'Student_{i+1}',
-        'id': f'S{1000+i}'
-    })
-
-# Generate files for each day
-start_date = datetime(2023, 10, 1)
-
-for day in range(NUM_DAYS):
-    current_date = start_date + timedelta(days=day)
-    date_str = current_date.strftime('%Y-%m-%d')
-    filename = f"{date_str}_comment_sheet.xlsx"
-    filepath = os.path.join(INPUT_DIR, filename)
-
-    # Randomly select students who submitted (simulate absentees)
-    num_submissions = random.randint(15, NUM_STUDENTS)
-    submitting_students = random.sample(students, num_submissions)
-
-    data = []
-    for s in submitting_students:
-        # Create a row with empty columns A-D, and data in E, F, G
-        # Pandas dataframe construction
-        row = {
-            'A': '', 'B': '', 'C': '', 'D': '',
-            'E': s['name'],         # Full Name
-            'F': s['id'],           # Student ID
-            'G': f"Comment from {s['name']} on {date_str}" # Comment
-        }
-        data.append(row)
-
-    df = pd.DataFrame(data)
-    
-    # Rename columns to map to Excel columns (A, B, C... work differently in pandas read/write, 
-    # but for simplicity we will write with header=False to simulate the form structure if needed.
-    # However, usually forms have headers. Let's assume row 1 is header.
-    # The prompt says "E列 Full Name", so E is the 5th column.
-    
-    # Let's create a DataFrame with explicit column positions
-    # Columns: A, B, C, D, Full Name, Student ID, Comment
-    # Column indices: 0, 1, 2, 3, 4, 5, 6
-    
-    final_df = pd.DataFrame(columns=['ColA', 'ColB', 'ColC', 'ColD', 'フルネーム', 'Q00_学籍番号', 'Q01_コメントシート'])
-    
-    for i, s in enumerate(submitting_students):
-        comment = f"Comment from {s['name']} on {date_str}"
-        # We can simulate empty comment sometimes
-        if random.random() < 0.1:
-            comment = "" 
-            
-        final_df.loc[i] = ['', '', '', '', s['name'], s['id'], comment]
-
-    # Save to Excel
-    print(f"Generating {filepath} with {len(final_df)} comments.")
-    final_df.to_excel(filepath, index=False)
-
-print("Test data generation complete.")
+# Highlight colors teachers use on comment cells
+HIGHLIGHT_COLORS = ["FFFFFF00", "FFFFC000", "FF92D050", "FF00B0F0"]
+
+def generate(output_dir=INPUT_DIR, students=NUM_STUDENTS, days=NUM_DAYS, comment_length=40,
+             typo_rate=0.0, fill_rate=0.0, attendance_size=None, year=None,
+             submit_rate=0.85, resubmit_rate=0.05, seed=None):
+    """
+    Writes one comment sheet per day (YYYY-MM-DD_comment_sheet.xlsx) and, if
+    attendance_size is given, an attendance sheet (KogibetuSeiseki_test.xlsx).
+    Layout follows aggregator.CONFIG defaults: A=Submission ID, C=Course,
+    E=Name, F=Student ID, G=Comment; attendance has 6 header rows, B=ID, C=Name.
+
+    comment_length: average comment length in characters
+    typo_rate: share of rows with a mistyped Student ID (matched by name instead)
+    fill_rate: share of comment cells with a highlight color
+    attendance_size: students on the attendance sheet (None = no attendance sheet)
+    year: course year written to Column C (default: year of the first day)
+    Returns (comment sheet paths, attendance path or None).
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    start_date = datetime(2025, 4, 7)
+    course = f"{year or start_date.year}_Synthetic Lecture"
+
+    # Generate dummy students
+    roster = []
+    for i in range(students):
+        roster.append({
+            # Zero-padded, so no name is a prefix of another (names are matched by prefix)
+            'name': f'学生 {i+1:05d}',
+            'id': f'25BB{1000+i:05d}'
+        })
+
+    fills = [PatternFill(start_color=c, end_color=c, fill_type="solid") for c in HIGHLIGHT_COLORS]
+
+    # Generate files for each day
+    paths = []
+    sub_id = 1
+    for day in range(days):
+        date_str = (start_date + timedelta(days=day)).strftime('%Y-%m-%d')
+        filepath = os.path.join(output_dir, f"{date_str}_comment_sheet.xlsx")
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        ws.append(['ID', 'ColB', 'Course', 'ColD', 'フルネーム', 'Q00_学籍番号', 'Q01_コメントシート'])
+
+        # Randomly select students who submitted (simulate absentees)
+        submitting = [s for s in roster if rng.random() < submit_rate]
+        for s in submitting:
+            for _ in range(2 if rng.random() < resubmit_rate else 1):
+                student_id = s['id']
+                if rng.random() < typo_rate:
+                    # Mistyped last digit that matches nobody -> found by name instead
+                    student_id = student_id[:-1] + "x"
+
+                length = max(0, int(rng.gauss(comment_length, comment_length / 3)))
+                comment = (f"Comment from {s['name']} on {date_str} " * (length // 30 + 1))[:length]
+
+                comment_cell = comment
+                if rng.random() < fill_rate:
+                    comment_cell = WriteOnlyCell(ws, value=comment)
+                    comment_cell.fill = rng.choice(fills)
+
+                ws.append([sub_id, '', course, '', s['name'], student_id, comment_cell])
+                sub_id += 1
+
+        wb.save(filepath)
+        paths.append(filepath)
+        print(f"Generating {filepath} with {len(submitting)} students.")
+
+    attendance_path = None
+    if attendance_size is not None:
+        attendance_path = os.path.join(output_dir, "KogibetuSeiseki_test.xlsx")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for r in range(5):
+            ws.append([f"Header {r+1}"])
+        ws.append(['No', '学籍番号', '氏名'])
+        # Students beyond the comment-sheet cohort never submit (all "未回答")
+        for i in range(attendance_size):
+            if i < students:
+                ws.append([i + 1, roster[i]['id'], roster[i]['name']])
+            else:
+                ws.append([i + 1, f'25ZZ{i:05d}', f'欠席 {i+1}'])
+        wb.save(attendance_path)
+        print(f"Generating {attendance_path} with {attendance_size} students.")
+
+    return paths, attendance_path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic comment sheets for testing / テストデータ生成")
+    parser.add_argument("--output-dir", default=INPUT_DIR)
+    parser.add_argument("--students", type=int, default=NUM_STUDENTS)
+    parser.add_argument("--days", type=int, default=NUM_DAYS)
+    parser.add_argument("--comment-length", type=int, default=40)
+    parser.add_argument("--typo-rate", type=float, default=0.0)
+    parser.add_argument("--fill-rate", type=float, default=0.0)
+    parser.add_argument("--attendance-size", type=int, default=None)
+    parser.add_argument("--year", default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    generate(args.output_dir, args.students, args.days, args.comment_length, args.typo_rate,
+             args.fill_rate, args.attendance_size, args.year, seed=args.seed)
+    print("Test data generation complete.")
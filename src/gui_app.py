@@ -1,10 +1,19 @@
+import time
+STARTUP_T0 = time.perf_counter() # for --startup-time
+
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 import tkinter.ttk as ttk
-import aggregator
+import parse_cache
 import os
+import sys
 import threading
+import multiprocessing
 import datetime
+import queue
+
+# The aggregation engine (aggregator -> openpyxl, xlrd, ...) is not imported here:
+# EngineLoader imports it on a background thread once the window is up.
 
 # --- Translation Dictionary ---
 TRANSLATIONS = {
@@ -36,6 +45,13 @@ TRANSLATIONS = {
         "att_selection_cancelled": "出席表の選択がキャンセルされました。",
         "critical_error": "致命的なエラー: ",
         "save_as": "保存先を指定",
+        "cancel": "中止",
+        "cancelling": "中止しています... (読み込み中のファイルが終わるまでお待ちください)",
+        "cancelled": "集計を中止しました。ファイルは保存されていません。",
+        "progress": "{index}/{total} ファイル ・ {rows_per_sec:,.0f} 行/秒",
+        "file_done": "[{index}/{total}] {file}: {rows} 行",
+        "saving": "保存中...",
+        "engine_loading": "集計エンジンを読み込み中です... (準備ができしだい開始します)",
         "footer": "制作：2025年度院生（有志）"
     },
     "EN": {
@@ -66,16 +82,63 @@ TRANSLATIONS = {
         "att_selection_cancelled": "Attendance selection cancelled.",
         "critical_error": "CRITICAL ERROR: ",
         "save_as": "Save Output As",
+        "cancel": "Cancel",
+        "cancelling": "Cancelling... (waiting for the file being read)",
+        "cancelled": "Aggregation cancelled. No file was saved.",
+        "progress": "{index}/{total} files · {rows_per_sec:,.0f} rows/s",
+        "file_done": "[{index}/{total}] {file}: {rows} rows",
+        "saving": "Saving...",
+        "engine_loading": "Loading the aggregation engine... (starts as soon as it is ready)",
         "footer": "Developed by 2025 Graduate Students"
     }
 }
 
 import platform
 
+class EngineLoader:
+    """
+    Imports the aggregation engine on a background thread, so the window does not
+    wait for openpyxl / xlrd. get() waits until the import has finished.
+    """
+
+    def __init__(self):
+        self.module = None
+        self.error = None
+        self.seconds = None  # time spent importing
+        self.ready_at = None # perf_counter() when done
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, daemon=True)
+            self._thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            import aggregator
+            self.module = aggregator
+        except Exception as e:
+            self.error = e
+        self.ready_at = time.perf_counter()
+        self.seconds = self.ready_at - start
+        self._done.set()
+
+    def ready(self):
+        return self._done.is_set()
+
+    def get(self):
+        self.start()
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.module
+
 class CommentAggregatorApp:
     def __init__(self, root):
         self.root = root
-        self.root.geometry("500x480") # Compact size
+        self.root.geometry("500x540") # Compact size
         
         # OS Detection
         self.is_windows = platform.system() == "Windows"
@@ -125,6 +188,13 @@ class CommentAggregatorApp:
         # Variables
         self.selected_files = []
         self.attendance_file = None
+
+        # Background job: the worker thread only puts events on this queue,
+        # the Tk main loop polls it (Tk widgets must not be touched from other threads)
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.job_started = None
+        self.job_rows = 0
         
         # --- Section 1: Input Files ---
         self.frame_input = ttk.LabelFrame(main_frame, padding="5 5 5 5")
@@ -168,8 +238,18 @@ class CommentAggregatorApp:
         self.frame_action = ttk.LabelFrame(main_frame, padding="5 5 5 5")
         self.frame_action.pack(fill=tk.BOTH, expand=True)
         
-        self.btn_run = ttk.Button(self.frame_action, command=self.run_aggregation, state=tk.DISABLED)
-        self.btn_run.pack(fill=tk.X, pady=(0, 5))
+        frame_buttons = ttk.Frame(self.frame_action)
+        frame_buttons.pack(fill=tk.X, pady=(0, 5))
+        self.btn_cancel = ttk.Button(frame_buttons, command=self.cancel_aggregation, state=tk.DISABLED)
+        self.btn_cancel.pack(side=tk.RIGHT, padx=(5, 0))
+        self.btn_run = ttk.Button(frame_buttons, command=self.run_aggregation, state=tk.DISABLED)
+        self.btn_run.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        # Progress (files done / total) and throughput
+        self.progress_bar = ttk.Progressbar(self.frame_action, mode="determinate", maximum=100)
+        self.progress_bar.pack(fill=tk.X)
+        self.label_progress = ttk.Label(self.frame_action, foreground="gray")
+        self.label_progress.pack(anchor=tk.W, pady=(2, 5))
         
         # Log Area
         self.log_area = scrolledtext.ScrolledText(self.frame_action, height=6, state='disabled', font=("Consolas", 9), bg="#f8f9fa", relief=tk.FLAT)
@@ -183,6 +263,10 @@ class CommentAggregatorApp:
         self.update_ui_text()
         self.log(TRANSLATIONS[self.lang]["ready"])
 
+        # Pre-warm the engine once the window has been drawn
+        self.engine = EngineLoader()
+        self.root.after(100, self.engine.start)
+
     def create_resource_path(self, relative_path):
         """ Get absolute path to resource, works for dev and for PyInstaller """
         try:
@@ -225,6 +309,7 @@ class CommentAggregatorApp:
         self.frame_action.config(text=t["step3"])
         self.frame_action.config(text=t["step3"])
         self.btn_run.config(text=t["run"])
+        self.btn_cancel.config(text=t["cancel"])
         
         self.label_footer.config(text=t["footer"])
 
@@ -238,13 +323,14 @@ class CommentAggregatorApp:
         t = TRANSLATIONS[self.lang]
         files = filedialog.askopenfilenames(
             title=t["select_files"],
-            filetypes=[("Excel Files", "*.xlsx *.xls")]
+            filetypes=[("Excel / ZIP", "*.xlsx *.xls *.zip"), ("Excel Files", "*.xlsx *.xls"), ("ZIP", "*.zip")]
         )
         if files:
             self.selected_files = list(files)
             self.label_file_count.config(text=f"{len(self.selected_files)}{t['files_selected']}", foreground="#008800")
             self.btn_run.config(state=tk.NORMAL)
-            self.log(f"Selected {len(files)} files.")
+            archives = sum(1 for f in files if f.lower().endswith(".zip"))
+            self.log(f"Selected {len(files)} files" + (f" ({archives} ZIP archives)." if archives else "."))
         else:
             self.log(t["file_selection_cancelled"])
 
@@ -280,7 +366,8 @@ class CommentAggregatorApp:
         
         output_file = filedialog.asksaveasfilename(
             defaultextension=".xlsx",
-            filetypes=[("Excel Files", "*.xlsx")],
+            # CSV / Parquet / Feather: unstyled summary + long-format records (export.py)
+            filetypes=[("Excel Files", "*.xlsx"), ("CSV", "*.csv"), ("Parquet", "*.parquet"), ("Feather", "*.feather")],
             initialfile="summary_output.xlsx",
             title=t["save_as"]
         )
@@ -289,28 +376,108 @@ class CommentAggregatorApp:
             return
 
         self.btn_run.config(state=tk.DISABLED)
+        self.btn_cancel.config(state=tk.NORMAL)
         self.log(f"{t['processing']}{os.path.basename(output_file)}")
-        
-        # Run in thread
-        threading.Thread(target=self.process_thread, args=(output_file, target_year, self.attendance_file), daemon=True).start()
 
-    def process_thread(self, output_file, target_year, attendance_file):
-        t = TRANSLATIONS[self.lang]
+        # Reset progress
+        self.cancel_event.clear()
+        self.progress_bar.config(value=0)
+        self.label_progress.config(text="")
+        self.job_started = time.perf_counter()
+        self.job_rows = 0
+        if not self.engine.ready():
+            self.log(t["engine_loading"])
+
+        # Run in thread; results come back through self.events
+        threading.Thread(target=self.process_thread, args=(list(self.selected_files), output_file, target_year, self.attendance_file), daemon=True).start()
+        self.root.after(100, self.poll_events)
+
+    def cancel_aggregation(self):
+        """
+        Asks the running job to stop; it does so before reading the next file.
+        """
+        self.cancel_event.set()
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.log(TRANSLATIONS[self.lang]["cancelling"])
+
+    def process_thread(self, input_files, output_file, target_year, attendance_file):
+        """
+        Worker thread. Never touches Tk: progress events and the result go on the queue.
+        """
         try:
-            success, message = aggregator.process_files(self.selected_files, output_file, target_year, attendance_file)
-            if success:
-                self.log(t["success"] + message)
-                messagebox.showinfo(t["success_title"], t["success_msg"])
-            else:
-                self.log("FAILED: " + message)
-                messagebox.showerror(t["error"], message)
+            aggregator = self.engine.get()
+            success, message = aggregator.process_files(input_files, output_file, target_year, attendance_file,
+                                                        cache=parse_cache.ParseCache(), progress=self.events.put,
+                                                        cancel=self.cancel_event)
+            self.events.put({"event": "done", "success": success, "message": message})
         except Exception as e:
-            self.log(t["critical_error"] + str(e))
-            messagebox.showerror(t["error"], str(e))
-        finally:
-            self.root.after(0, lambda: self.btn_run.config(state=tk.NORMAL))
+            self.events.put({"event": "crashed", "message": str(e)})
+
+    def poll_events(self):
+        """
+        Runs on the Tk main loop: applies all queued events, then polls again until the job ends.
+        """
+        t = TRANSLATIONS[self.lang]
+        finished = False
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            kind = event["event"]
+            if kind == "file":
+                self.job_rows += event["rows_read"]
+                elapsed = time.perf_counter() - self.job_started
+                self.progress_bar.config(value=100 * event["index"] / event["total"])
+                self.label_progress.config(text=t["progress"].format(
+                    index=event["index"], total=event["total"],
+                    rows_per_sec=self.job_rows / elapsed if elapsed > 0 else 0))
+                self.log(t["file_done"].format(index=event["index"], total=event["total"],
+                                               file=event["file"], rows=event["rows_read"]))
+            elif kind == "stage_start" and event["stage"] == "write":
+                self.log(t["saving"])
+            elif kind == "done":
+                finished = True
+                if self.cancel_event.is_set() and not event["success"]:
+                    self.log(t["cancelled"])
+                elif event["success"]:
+                    self.log(t["success"] + event["message"])
+                    messagebox.showinfo(t["success_title"], t["success_msg"])
+                else:
+                    self.log("FAILED: " + event["message"])
+                    messagebox.showerror(t["error"], event["message"])
+            elif kind == "crashed":
+                finished = True
+                self.log(t["critical_error"] + event["message"])
+                messagebox.showerror(t["error"], event["message"])
+
+        if finished:
+            self.btn_run.config(state=tk.NORMAL)
+            self.btn_cancel.config(state=tk.DISABLED)
+        else:
+            self.root.after(100, self.poll_events)
+
+    def report_startup(self, window_seconds):
+        """
+        --startup-time: logs how long the window and the engine took to come up
+        (measured from the start of this module, so exe unpacking is not included).
+        """
+        if not self.engine.ready():
+            self.root.after(20, self.report_startup, window_seconds)
+            return
+        engine = f"{self.engine.ready_at - STARTUP_T0:.2f} s (import {self.engine.seconds:.2f} s)"
+        if self.engine.error is not None:
+            engine = f"failed: {self.engine.error}"
+        message = f"Startup: window {window_seconds:.2f} s, engine {engine}"
+        print(message)
+        self.log(message)
 
 if __name__ == "__main__":
+    # Required for the process pool inside the PyInstaller exe
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = CommentAggregatorApp(root)
+    if "--startup-time" in sys.argv:
+        # Idle callbacks run once the window has been drawn
+        root.after_idle(lambda: app.report_startup(time.perf_counter() - STARTUP_T0))
     root.mainloop()
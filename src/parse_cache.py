@@ -0,0 +1,225 @@
+import os
+import pickle
+import zlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# ==============================================================================
+# Parse cache (解析キャッシュ)
+# Stores the rows extracted from each comment sheet (and the parsed attendance
+# roster) on disk, so re-runs only parse new or changed files. Entries are keyed
+# by the caller (aggregator uses the file content hash + CONFIG column indices).
+# MemoryParseCache is the same thing kept in memory, for the Streamlit server.
+#
+# Clear the cache / キャッシュ削除:
+#   python src/parse_cache.py --clear
+# ==============================================================================
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024 # 256 MB
+DEFAULT_MEMORY_MAX_BYTES = 128 * 1024 * 1024 # 128 MB
+ENTRY_SUFFIX = ".bin"
+
+def default_cache_dir():
+    """
+    Returns the per-user cache folder.
+    Windows: %LOCALAPPDATA%\\KSGadget\\parse_cache, others: ~/.cache/ksgadget/parse_cache
+    """
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "KSGadget", "parse_cache")
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "ksgadget", "parse_cache")
+
+class ParseCache:
+    """
+    On-disk cache of parsed sheet rows with a size cap.
+    Each entry is one file (zlib-compressed pickle). A hit refreshes the file's
+    mtime, and when the cap is exceeded the least recently used entries are removed.
+    Cache errors never fail a run: a broken entry is treated as a miss.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        Returns the cached rows for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                rows = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Ignoring broken cache entry {os.path.basename(path)}: {e}")
+            self._remove(path)
+            return None
+
+        # Mark as recently used (LRU order is the file mtime)
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return rows
+
+    def put(self, key, rows):
+        """
+        Stores rows for key, then evicts old entries if the cache is too big.
+        """
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            data = zlib.compress(pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL))
+            # Write to a temp file first so a crash never leaves a half-written entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Could not write parse cache: {e}")
+            if tmp_path:
+                self._remove(tmp_path)
+            return
+        self.evict()
+
+    def _entries(self):
+        """
+        Returns [(mtime, size, path), ...] for all cache entries.
+        """
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(ENTRY_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """
+        Deletes every cache entry. Returns the number of entries removed.
+        """
+        entries = self._entries()
+        for _, _, path in entries:
+            self._remove(path)
+        return len(entries)
+
+    def size(self):
+        """
+        Returns (number of entries, total bytes).
+        """
+        entries = self._entries()
+        return len(entries), sum(size for _, size, _ in entries)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class MemoryParseCache:
+    """
+    In-process LRU cache with the same get/put interface as ParseCache.
+    Meant to be shared by all sessions of a long-running server, so it is thread-safe.
+    Values are stored as-is (callers must not modify them); their size is counted
+    as the pickled length, and least recently used entries are dropped above max_bytes.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (value, size), oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Stores value for key, then evicts old entries if the cache is too big.
+        Values larger than max_bytes are not stored.
+        """
+        try:
+            size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            print(f"Could not cache value: {e}")
+            return
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total -= old[1]
+            self._entries[key] = (value, size)
+            self._total += size
+            while self._total > self.max_bytes:
+                _, (_, old_size) = self._entries.popitem(last=False)
+                self._total -= old_size
+
+    def clear(self):
+        """
+        Deletes every cache entry. Returns the number of entries removed.
+        """
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._total = 0
+            return count
+
+    def size(self):
+        """
+        Returns (number of entries, total bytes).
+        """
+        with self._lock:
+            return len(self._entries), self._total
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Comment sheet parse cache / 解析キャッシュ")
+    parser.add_argument("--dir", default=None, help="Cache folder (default: per-user cache folder)")
+    parser.add_argument("--clear", action="store_true", help="Delete all cache entries")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.dir)
+    if args.clear:
+        removed = cache.clear()
+        print(f"Removed {removed} cache entries from {cache.cache_dir}")
+    else:
+        count, total = cache.size()
+        print(f"{cache.cache_dir}: {count} entries, {total / 1024 / 1024:.1f} MB")
@@ -0,0 +1,218 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from openpyxl import Workbook
+
+import aggregator
+
+# ==============================================================================
+# Sharded output (分割出力)
+# For large lecture courses one sheet of every student x every date is slow to
+# write and very slow to open. A ShardedWriter splits the summary into smaller
+# tables and writes each one with the usual styling ("未回答" and the preserved
+# comment colors), plus an "Index" sheet listing the shards:
+#   by="students" : every `size` students (in output order)
+#   by="month"    : one shard per month of date columns (YYYY-MM)
+#   by="section"  : one shard per course section (Column C of each student's latest submission)
+#   mode="sheets"    : one workbook, one sheet per shard
+#   mode="workbooks" : <output>_<shard>.xlsx per shard, written in parallel; <output> holds the index
+#
+#   pipeline = aggregator.Pipeline(writer=ShardedWriter("month", mode="workbooks"))
+# ==============================================================================
+
+SHARD_KEYS = ["students", "month", "section"]
+SHARD_MODES = ["sheets", "workbooks"]
+DEFAULT_SHARD_SIZE = 500
+NO_SECTION = "(none)" # shard of students without a submission
+OTHER_DATES = "other" # month shard of date columns that are not YYYY-MM-DD
+
+INDEX_COLUMNS = ["Shard", "Sheet / File", "Students", "Dates", "First date", "Last date", "Submissions"]
+
+_SHEET_NAME_RE = re.compile(r'[\[\]:*?/\\]')
+
+class Shard:
+    """
+    One part of a sharded summary: its name and SummaryTable, and where it is written.
+    """
+
+    def __init__(self, name, table):
+        self.name = name
+        self.table = table
+        self.target = None # sheet title or file path
+
+    def submissions(self):
+        return sum(1 for _ in self.table.cells.items())
+
+def _shard_table(table, rows, dates):
+    """
+    SummaryTable for a subset of rows and dates. The cells are copied into a plain dict,
+    so a shard can be sent to a worker process without the whole accumulator.
+    """
+    cells = {}
+    for norm_id in dict.fromkeys(r[0] for r in rows):
+        for date in dates:
+            cell = table.cells.get((norm_id, date))
+            if cell is not None:
+                cells[(norm_id, date)] = cell
+    return aggregator.SummaryTable(rows, dates, cells)
+
+def student_sections(accumulator):
+    """
+    NormID -> course text (Column C) of the student's latest submission.
+    """
+    latest = {}
+    for record in accumulator.records():
+        seen = latest.get(record.norm_id)
+        if seen is None or record.date > seen[0]:
+            latest[record.norm_id] = (record.date, record.course or NO_SECTION)
+    return {norm_id: course for norm_id, (_, course) in latest.items()}
+
+def split_table(table, by="students", size=DEFAULT_SHARD_SIZE):
+    """
+    Splits a SummaryTable into [Shard, ...] (see the header for the keys).
+    Section shards need table.submissions (the SubmissionAccumulator) for the course column.
+    """
+    if by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key: {by} (use one of {', '.join(SHARD_KEYS)})")
+    rows, dates = table.rows, table.dates
+
+    if by == "students":
+        size = max(1, int(size))
+        width = len(str(len(rows)))
+        return [Shard(f"{start + 1:0{width}d}-{min(start + size, len(rows)):0{width}d}",
+                      _shard_table(table, rows[start:start + size], dates))
+                for start in range(0, len(rows), size)] or [Shard("all", table)]
+
+    if by == "month":
+        months = {}
+        for date in dates:
+            month = date[:7] if aggregator._DATE_RE.fullmatch(date) else OTHER_DATES
+            months.setdefault(month, []).append(date)
+        return [Shard(month, _shard_table(table, rows, months[month]))
+                for month in sorted(months, key=lambda m: (m == OTHER_DATES, m))] or [Shard("all", table)]
+
+    sections = student_sections(table.submissions) if table.submissions is not None else {}
+    groups = {}
+    for row in rows:
+        groups.setdefault(sections.get(row[0], NO_SECTION), []).append(row)
+    return [Shard(section, _shard_table(table, groups[section], dates))
+            for section in sorted(groups, key=lambda s: (s == NO_SECTION, s))] or [Shard("all", table)]
+
+def _sheet_titles(names):
+    """
+    Excel sheet titles for the shard names: no []:*?/\\, at most 31 characters, unique
+    (case-insensitive), and not "Index".
+    """
+    titles = []
+    used = {"index"}
+    for name in names:
+        base = _SHEET_NAME_RE.sub("_", name).strip("'") or "shard"
+        title = base[:31]
+        n = 2
+        while title.lower() in used:
+            suffix = f"~{n}"
+            title = base[:31 - len(suffix)] + suffix
+            n += 1
+        used.add(title.lower())
+        titles.append(title)
+    return titles
+
+def _file_names(output_file, names):
+    base, ext = os.path.splitext(os.fspath(output_file))
+    return [f"{base}_{title}{ext or '.xlsx'}" for title in _sheet_titles(names)]
+
+def _write_index(ws, shards):
+    ws.append(INDEX_COLUMNS)
+    for shard in shards:
+        dates = shard.table.dates
+        ws.append([shard.name, os.path.basename(shard.target), len(shard.table.rows), len(dates),
+                   dates[0] if dates else "", dates[-1] if dates else "", shard.submissions()])
+
+def _write_shard_file(path, table):
+    """
+    Writes one shard workbook (top-level, so it can run in a worker process).
+    """
+    aggregator.write_summary(path, table)
+    return path
+
+class ShardedWriter:
+    """
+    Pipeline writer that writes the summary in shards (see the header).
+    workers: processes for mode="workbooks" (None = one per CPU, 1 = serial).
+    """
+
+    def __init__(self, by="students", size=DEFAULT_SHARD_SIZE, mode="sheets", workers=None):
+        if by not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key: {by} (use one of {', '.join(SHARD_KEYS)})")
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Unknown shard mode: {mode} (use one of {', '.join(SHARD_MODES)})")
+        self.by = by
+        self.size = size
+        self.mode = mode
+        self.workers = workers
+
+    def __call__(self, output_file, table):
+        shards = split_table(table, self.by, self.size)
+        print(f"Writing {len(shards)} shards by {self.by} ({self.mode})")
+        if self.mode == "sheets":
+            self._write_sheets(output_file, shards)
+        else:
+            if not isinstance(output_file, (str, os.PathLike)):
+                raise ValueError("Separate shard workbooks need an output path.")
+            self._write_workbooks(output_file, shards)
+
+    def _write_sheets(self, output_file, shards):
+        # One write-only workbook is a single stream, so its sheets are written one after another
+        wb = Workbook(write_only=True)
+        index = wb.create_sheet("Index")
+        for shard, title in zip(shards, _sheet_titles([s.name for s in shards])):
+            shard.target = title
+        _write_index(index, shards)
+        for shard in shards:
+            aggregator.write_summary_sheet(wb.create_sheet(shard.target), shard.table)
+        wb.save(output_file)
+
+    def _write_workbooks(self, output_file, shards):
+        for shard, path in zip(shards, _file_names(output_file, [s.name for s in shards])):
+            shard.target = path
+
+        workers = self.workers or os.cpu_count() or 1
+        workers = max(1, min(workers, len(shards)))
+        remaining = list(shards)
+        pool = None
+        futures = []
+        if workers > 1:
+            try:
+                pool = ProcessPoolExecutor(max_workers=workers)
+                futures = [(shard, pool.submit(_write_shard_file, shard.target, shard.table)) for shard in shards]
+            except (OSError, NotImplementedError) as e:
+                print(f"Process pool unavailable ({e}), writing shards serially.")
+                futures = []
+        try:
+            for shard, future in futures:
+                try:
+                    future.result()
+                except BrokenProcessPool as e:
+                    print(f"Process pool unavailable ({e}), writing shards serially.")
+                    break
+                remaining.remove(shard)
+            for shard in remaining:
+                _write_shard_file(shard.target, shard.table)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        wb = Workbook(write_only=True)
+        _write_index(wb.create_sheet("Index"), shards)
+        wb.save(output_file)
+
+def parse_shard_option(value):
+    """
+    "students:500" / "students" / "month" / "section" -> (by, size) for the CLIs.
+    """
+    by, _, size = value.partition(":")
+    if by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key: {by} (use one of {', '.join(SHARD_KEYS)})")
+    return by, int(size) if size else DEFAULT_SHARD_SIZE
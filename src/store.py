@@ -0,0 +1,492 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import aggregator
+import parse_cache
+import shard
+from export import is_export_file, write_export
+
+# ==============================================================================
+# Aggregation store (集計データベース)
+# Optional local SQLite database (stdlib sqlite3) that keeps the results of
+# earlier runs, so a course can be queried across weeks and a new day only
+# costs that day:
+#   sheets / sheet_rows : raw rows of every parsed sheet, keyed by content hash
+#   files               : ingested files (path -> content hash, date, order)
+#   file_submissions    : each file's deduplicated (NormID, Date) submissions
+#   submissions         : the merged latest submission per (NormID, Date)
+#   rosters             : every attendance sheet used, plus when it was switched to
+# refresh() parses only unseen content, re-matches only new / changed files and
+# rewrites the merged submissions of the affected dates in one batch. The summary
+# is then read back with one indexed query and written by the usual writers.
+#
+#   python src/store.py course.sqlite INPUT_DIR summary.xlsx --year 2025
+#   python src/store.py course.sqlite --info
+# ==============================================================================
+
+SCHEMA_VERSION = 2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    hash TEXT PRIMARY KEY,
+    name TEXT,
+    rows INTEGER,
+    parsed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    hash TEXT,
+    row_order INTEGER,
+    sub_id TEXT,
+    course TEXT,
+    name TEXT,
+    id TEXT,
+    comment TEXT,
+    color TEXT,
+    PRIMARY KEY (hash, row_order)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT,
+    date TEXT,
+    position INTEGER,
+    ingested_at TEXT
+);
+CREATE TABLE IF NOT EXISTS file_submissions (
+    path TEXT,
+    norm_id TEXT,
+    date TEXT,
+    sub_id REAL,
+    name TEXT,
+    display_id TEXT,
+    comment TEXT,
+    color TEXT,
+    course TEXT,
+    PRIMARY KEY (path, norm_id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_file_submissions_key ON file_submissions (date, norm_id);
+CREATE TABLE IF NOT EXISTS submissions (
+    norm_id TEXT,
+    date TEXT,
+    sub_id REAL,
+    name TEXT,
+    display_id TEXT,
+    comment TEXT,
+    color TEXT,
+    course TEXT,
+    path TEXT,
+    PRIMARY KEY (norm_id, date)
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_date ON submissions (date);
+CREATE TABLE IF NOT EXISTS rosters (
+    id INTEGER PRIMARY KEY,
+    hash TEXT UNIQUE,
+    name TEXT,
+    students INTEGER,
+    loaded_at TEXT
+);
+CREATE TABLE IF NOT EXISTS roster_students (
+    roster_id INTEGER,
+    position INTEGER,
+    norm_id TEXT,
+    name TEXT,
+    original_id TEXT,
+    PRIMARY KEY (roster_id, position)
+);
+CREATE TABLE IF NOT EXISTS roster_names (
+    roster_id INTEGER,
+    norm_name TEXT,
+    norm_id TEXT,
+    PRIMARY KEY (roster_id, norm_name)
+);
+CREATE TABLE IF NOT EXISTS roster_history (
+    roster_id INTEGER,
+    used_at TEXT
+);
+"""
+
+# Winner per (NormID, Date) among the files' submissions, same rule as
+# SubmissionAccumulator: highest SubmissionID, later file on ties.
+_MERGE_DATES = """
+INSERT INTO submissions (norm_id, date, sub_id, name, display_id, comment, color, course, path)
+SELECT norm_id, date, sub_id, name, display_id, comment, color, course, path FROM (
+    SELECT s.*, ROW_NUMBER() OVER (
+        PARTITION BY s.norm_id, s.date ORDER BY s.sub_id DESC, f.position DESC
+    ) AS rank
+    FROM file_submissions s JOIN files f ON f.path = s.path
+    WHERE s.date IN (SELECT date FROM temp.affected_dates)
+) WHERE rank = 1
+"""
+
+def _now():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+def _source_path(source):
+    """
+    Key of an input in the files table: the absolute path, or the name of an in-memory source.
+    Sheets inside a .zip are keyed by the archive's key plus the member path.
+    """
+    if isinstance(source, tuple):
+        return source[0]
+    if isinstance(source, aggregator.ZipMember):
+        return f"{_source_path(source.archive)}/{source.path}"
+    return os.path.abspath(source)
+
+class AggregationStore:
+    """
+    SQLite-backed aggregation state for one course.
+    Raises AggregationError if the database cannot be used.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        try:
+            self.conn = sqlite3.connect(db_path)
+            self.conn.executescript(_SCHEMA)
+        except sqlite3.Error as e:
+            raise aggregator.AggregationError(f"Cannot open store {db_path}: {e}")
+        version = self._meta("schema_version")
+        if version is None:
+            with self.conn:
+                self._set_meta("schema_version", SCHEMA_VERSION)
+        elif int(version) != SCHEMA_VERSION:
+            self.conn.close()
+            raise aggregator.AggregationError(
+                f"{db_path} was created by another version of the store (schema {version}). Delete it to rebuild.")
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # --- Roster ---
+
+    def _save_roster(self, attendance_file, cache=None):
+        """
+        Loads the attendance sheet, stores it if its content is new and makes it current.
+        Returns (roster id, Roster).
+        """
+        source = aggregator.as_source(attendance_file)
+        roster = aggregator.load_roster(source, cache)
+        key = aggregator._roster_cache_key(source)
+        row = self.conn.execute("SELECT id FROM rosters WHERE hash = ?", (key,)).fetchone()
+        with self.conn:
+            if row:
+                roster_id = row[0]
+            else:
+                cur = self.conn.execute("INSERT INTO rosters (hash, name, students, loaded_at) VALUES (?, ?, ?, ?)",
+                                        (key, aggregator._source_name(source), len(roster), _now()))
+                roster_id = cur.lastrowid
+                self.conn.executemany(
+                    "INSERT INTO roster_students (roster_id, position, norm_id, name, original_id) VALUES (?, ?, ?, ?, ?)",
+                    [(roster_id, i, nid, roster.names.get(nid), roster.original_ids.get(nid))
+                     for i, nid in enumerate(roster.ids_order)])
+                self.conn.executemany("INSERT INTO roster_names (roster_id, norm_name, norm_id) VALUES (?, ?, ?)",
+                                      [(roster_id, n, nid) for n, nid in roster.name_map.items()])
+            if self._meta("roster_id") != str(roster_id):
+                self._set_meta("roster_id", roster_id)
+                self.conn.execute("INSERT INTO roster_history (roster_id, used_at) VALUES (?, ?)", (roster_id, _now()))
+        return roster_id, roster
+
+    def roster(self, roster_id=None):
+        """
+        Returns a stored Roster (default: the current one), or an empty Roster() if there is none.
+        """
+        if roster_id is None:
+            roster_id = self._meta("roster_id")
+            if roster_id is None:
+                return aggregator.Roster()
+        ids_order, names, original_ids = [], {}, {}
+        for nid, name, original_id in self.conn.execute(
+                "SELECT norm_id, name, original_id FROM roster_students WHERE roster_id = ? ORDER BY position",
+                (roster_id,)):
+            ids_order.append(nid)
+            names[nid] = name
+            original_ids[nid] = original_id
+        name_map = dict(self.conn.execute("SELECT norm_name, norm_id FROM roster_names WHERE roster_id = ?",
+                                          (roster_id,)))
+        return aggregator.Roster(ids_order, names, original_ids, name_map)
+
+    def roster_history(self):
+        """
+        [(used_at, attendance sheet name, students), ...] oldest first.
+        """
+        return self.conn.execute(
+            "SELECT h.used_at, r.name, r.students FROM roster_history h JOIN rosters r ON r.id = h.roster_id "
+            "ORDER BY h.rowid").fetchall()
+
+    # --- Ingestion ---
+
+    def _ingest_sheets(self, sources, workers=None, cache=None):
+        """
+        Parses the sources whose content is not stored yet. Each sheet is committed on
+        its own, so a failing file does not throw away the ones parsed before it.
+        Returns [content key, ...] in input order.
+        """
+        try:
+            keys = [aggregator._cache_key(s) for s in sources]
+        except OSError as e:
+            raise aggregator.AggregationError(f"Error processing {e.filename}: {e}")
+        known = {k for (k,) in self.conn.execute("SELECT hash FROM sheets")}
+        todo = {}
+        for source, key in zip(sources, keys):
+            if key not in known:
+                todo.setdefault(key, source)
+        if not todo:
+            return keys
+
+        for key, (source, _, rows) in zip(todo, aggregator.read_sheets(list(todo.values()), workers, cache=cache)):
+            with self.conn:
+                self.conn.execute("INSERT INTO sheets (hash, name, rows, parsed_at) VALUES (?, ?, ?, ?)",
+                                  (key, aggregator._source_name(source), len(rows), _now()))
+                self.conn.executemany(
+                    "INSERT INTO sheet_rows (hash, row_order, sub_id, course, name, id, comment, color) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(key, i) + tuple(row) for i, row in enumerate(rows)])
+        return keys
+
+    def _sheet_rows(self, key):
+        return self.conn.execute(
+            "SELECT sub_id, course, name, id, comment, color FROM sheet_rows WHERE hash = ? ORDER BY row_order",
+            (key,)).fetchall()
+
+    def refresh(self, input_files, target_year=None, attendance_file=None, workers=None, cache=None):
+        """
+        Makes the store match input_files (paths or in-memory sources, in merge order):
+        new content is parsed, new / changed files are matched and deduplicated, removed
+        files are dropped, and the merged submissions of every affected date are rebuilt.
+        .zip archives are expanded to their sheets (see aggregator.read_archive).
+        attendance_file=None uses an attendance sheet found in an archive, else keeps
+        using the stored one (if any).
+        target_year: year or FilterSpec; files outside its date range are left out of the store.
+        Changing the roster or the course filter re-matches every file from the stored rows.
+        Returns a dict of counts. Raises AggregationError on failure.
+        """
+        sources, archive_attendance = aggregator.expand_archives(input_files)
+        attendance_file = attendance_file or archive_attendance
+        if attendance_file:
+            roster_id, roster = self._save_roster(attendance_file, cache)
+        else:
+            roster_id, roster = self._meta("roster_id"), self.roster()
+
+        spec = aggregator.FilterSpec.coerce(target_year)
+        sources, _ = aggregator.prune_files(sources, spec)
+        keys = self._ingest_sheets(sources, workers, cache)
+
+        # path -> (content key, date, position); a repeated input counts once, at its last position
+        wanted = {}
+        for position, (source, key) in enumerate(zip(sources, keys)):
+            wanted[_source_path(source)] = (key, aggregator._date_from_filename(source), position)
+        stored = {path: (key, date, position) for path, key, date, position in
+                  self.conn.execute("SELECT path, hash, date, position FROM files")}
+
+        match_key = f"{roster_id or ''}|{spec.course_key()}"
+        rematch_all = self._meta("match_key") != match_key
+        removed = [p for p in stored if p not in wanted]
+        changed = [p for p, (key, date, _) in wanted.items()
+                   if rematch_all or p not in stored or stored[p][:2] != (key, date)]
+        # The file order decides ties, so a reordered input list re-merges every date
+        kept = [p for p in stored if p in wanted]
+        reordered = sorted(kept, key=lambda p: stored[p][2]) != sorted(kept, key=lambda p: wanted[p][2])
+
+        dates = {stored[p][1] for p in removed + changed if p in stored} | {wanted[p][1] for p in changed}
+        match_stats = {"id": 0, "name": 0, "unmatched": 0}
+        start = time.perf_counter()
+
+        with self.conn:
+            conn = self.conn
+            for path in removed + changed:
+                conn.execute("DELETE FROM file_submissions WHERE path = ?", (path,))
+            conn.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+            conn.executemany(
+                "INSERT INTO files (path, hash, date, position, ingested_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET hash = excluded.hash, date = excluded.date, position = excluded.position, "
+                "ingested_at = CASE WHEN files.hash = excluded.hash THEN files.ingested_at ELSE excluded.ingested_at END",
+                [(p, key, date, position, _now()) for p, (key, date, position) in wanted.items()])
+
+            for path in changed:
+                key, date, _ = wanted[path]
+                sheet = [(path, date, self._sheet_rows(key))]
+                accumulator = aggregator.deduplicate(aggregator.normalize_records(sheet, roster, spec, match_stats))
+                conn.executemany(
+                    "INSERT INTO file_submissions (path, norm_id, date, sub_id, name, display_id, comment, color, course) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, *record) for record in accumulator.records()])
+
+            if reordered:
+                dates = {d for (d,) in conn.execute("SELECT DISTINCT date FROM files")} | dates
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_dates (date TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM temp.affected_dates")
+            conn.executemany("INSERT INTO temp.affected_dates (date) VALUES (?)", [(d,) for d in dates])
+            conn.execute("DELETE FROM submissions WHERE date IN (SELECT date FROM temp.affected_dates)")
+            conn.execute(_MERGE_DATES)
+            self._set_meta("match_key", match_key)
+
+        stats = {
+            "files": len(wanted),
+            "new": sum(1 for p in changed if p not in stored),
+            "changed": sum(1 for p in changed if p in stored),
+            "removed": len(removed),
+            "dates": len(dates),
+            "submissions": self.conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0],
+            "seconds": time.perf_counter() - start,
+        }
+        print(f"Store: {stats['new']} new, {stats['changed']} re-matched, {stats['removed']} removed of "
+              f"{stats['files']} files; {stats['dates']} dates merged ({stats['seconds']:.2f} s)")
+        if roster and changed:
+            print(f"Matched rows: {match_stats['id']} by ID, {match_stats['name']} by name, "
+                  f"{match_stats['unmatched']} not in attendance sheet.")
+        return stats
+
+    # --- Queries ---
+
+    def submissions(self):
+        """
+        The merged submissions as a SubmissionAccumulator.
+        """
+        accumulator = aggregator.SubmissionAccumulator()
+        for record in self.conn.execute(
+                "SELECT norm_id, date, sub_id, name, display_id, comment, color, course FROM submissions ORDER BY norm_id, date"):
+            accumulator.add(*record)
+        return accumulator
+
+    def table(self):
+        """
+        SummaryTable of the stored submissions, ordered by the current roster.
+        """
+        return aggregator.build_summary(self.submissions(), self.roster())
+
+    def files(self):
+        """
+        [(path, date, ingested_at, rows), ...] in merge order.
+        """
+        return self.conn.execute(
+            "SELECT f.path, f.date, f.ingested_at, s.rows FROM files f LEFT JOIN sheets s ON s.hash = f.hash "
+            "ORDER BY f.position").fetchall()
+
+    def vacuum(self):
+        """
+        Drops stored sheets / rosters no longer referenced and shrinks the database file.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM sheet_rows WHERE hash NOT IN (SELECT hash FROM files)")
+            self.conn.execute("DELETE FROM sheets WHERE hash NOT IN (SELECT hash FROM files)")
+        self.conn.execute("VACUUM")
+
+def process_with_store(db_path, input_files, output_file, target_year=None, attendance_file=None, workers=None, cache=None,
+                       writer=None):
+    """
+    process_files through an AggregationStore: refreshes the store from input_files,
+    then writes the summary from it. Returns (success, message).
+    writer: optional writer(output_file, table), e.g. a shard.ShardedWriter.
+    """
+    print(f"Processing {len(input_files)} files (store: {db_path})...")
+    print(f"Target Year Filter: {aggregator.FilterSpec.coerce(target_year)}")
+    try:
+        with AggregationStore(db_path) as store:
+            store.refresh(input_files, target_year, attendance_file, workers, cache)
+            table = store.table()
+    except aggregator.AggregationError as e:
+        return False, str(e)
+    except sqlite3.Error as e:
+        return False, f"Store error: {e}"
+
+    if not table.rows:
+        return False, "No data found."
+
+    print(f"Saving summary to {output_file}")
+    try:
+        if writer is None:
+            writer = write_export if is_export_file(output_file) else aggregator.write_summary
+        writer(output_file, table)
+        print("Done.")
+        return True, f"Saved to {os.path.basename(output_file)}"
+    except PermissionError:
+        return False, f"Permission denied: {output_file}. Close it and try again."
+    except Exception as e:
+        return False, f"Error saving file: {str(e)}"
+
+def print_info(db_path):
+    with AggregationStore(db_path) as store:
+        files = store.files()
+        print(f"{db_path}: {len(files)} files, {store.conn.execute('SELECT COUNT(*) FROM submissions').fetchone()[0]} submissions")
+        for path, date, ingested_at, rows in files:
+            print(f"  {date}  {rows or 0:>6} rows  {ingested_at}  {os.path.basename(path)}")
+        history = store.roster_history()
+        if history:
+            print("Attendance sheets:")
+            for used_at, name, students in history:
+                print(f"  {used_at}  {students} students  {name}")
+
+if __name__ == "__main__":
+    from watcher import scan
+
+    parser = argparse.ArgumentParser(description="Aggregate through a local SQLite store / 集計データベース")
+    parser.add_argument("db", help="Store file (created if missing), e.g. course.sqlite")
+    parser.add_argument("folder", nargs="?", help="Folder with the daily comment sheets")
+    parser.add_argument("output", nargs="?", help="Summary file (.xlsx, .csv, .parquet, .feather)")
+    parser.add_argument("--attendance", default=None,
+                        help="Attendance sheet (default: KogibetuSeiseki_ file in the folder, else the stored one)")
+    parser.add_argument("--year", default=None, help="Target year filter (Column C)")
+    parser.add_argument("--course-prefix", default=None, help="Only rows whose Column C starts with this")
+    parser.add_argument("--course-regex", default=None, help="Only rows whose Column C matches this regular expression")
+    parser.add_argument("--from", dest="date_from", default=None, help="First date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--to", dest="date_to", default=None, help="Last date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for new sheets (default: auto)")
+    parser.add_argument("--shard", default=None,
+                        help="Split the .xlsx summary: students[:N] (every N students), month or section")
+    parser.add_argument("--shard-mode", choices=shard.SHARD_MODES, default="sheets",
+                        help="One sheet per shard (default) or one workbook per shard")
+    parser.add_argument("--cache", action="store_true", help="Also use the per-user parse cache")
+    parser.add_argument("--info", action="store_true", help="List the stored files and attendance sheets")
+    parser.add_argument("--vacuum", action="store_true", help="Drop rows of sheets that are no longer used")
+    args = parser.parse_args()
+    try:
+        spec = aggregator.FilterSpec(args.year, args.course_prefix, args.course_regex, args.date_from, args.date_to)
+    except ValueError as e:
+        parser.error(str(e))
+    writer = None
+    if args.shard:
+        if args.output and is_export_file(args.output):
+            parser.error("--shard only applies to .xlsx output")
+        try:
+            writer = shard.ShardedWriter(*shard.parse_shard_option(args.shard), args.shard_mode)
+        except ValueError as e:
+            parser.error(str(e))
+
+    try:
+        if args.folder and args.output:
+            sheets, found_roster = scan(args.folder, args.output)
+            success, message = process_with_store(args.db, sorted(sheets), args.output, spec,
+                                                  args.attendance or found_roster, args.workers,
+                                                  parse_cache.ParseCache() if args.cache else None, writer)
+            print(message)
+            if not success:
+                sys.exit(1)
+        elif not (args.info or args.vacuum):
+            parser.error("give FOLDER and OUTPUT, or --info / --vacuum")
+        if args.vacuum:
+            with AggregationStore(args.db) as store:
+                store.vacuum()
+        if args.info:
+            print_info(args.db)
+    except aggregator.AggregationError as e:
+        print(e)
+        sys.exit(1)
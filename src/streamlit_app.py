@@ -7,17 +7,18 @@ if current_dir not in sys.path:
     sys.path.append(current_dir)
 
 import streamlit as st
-import tempfile
 import shutil
 import pandas as pd
 from datetime import datetime
 
 try:
-    from aggregator import process_files
+    from aggregator import process_buffers
+    from parse_cache import MemoryParseCache
 except ImportError as e:
     # Try fallback but keep original error if both fail
     try:
-        from src.aggregator import process_files
+        from src.aggregator import process_buffers
+        from src.parse_cache import MemoryParseCache
     except ImportError as e2:
         st.error(f"Critical Error: Could not import 'aggregator'.")
         st.error(f"Attempt 1 (Direct): {e}")
@@ -26,6 +27,15 @@ except ImportError as e:
         st.write("Current files in src:", os.listdir(os.path.dirname(os.path.abspath(__file__))))
         st.stop()
 
+@st.cache_resource
+def get_parse_cache():
+    """
+    One parse cache per server process, shared by all sessions.
+    Parsed rows / rosters are keyed by a digest of each upload's bytes, so changing
+    the year or adding one more sheet only parses what is new.
+    """
+    return MemoryParseCache()
+
 def main():
     st.set_page_config(
         page_title="コメントシート集計ツール", 
@@ -65,8 +75,8 @@ def main():
 
     with st.expander("ℹ️ 使い方 (How to use)", expanded=False):
         st.markdown("""
-        1. **「コメントシート」** (複数可) をアップロードします。
-        2. (任意) **「出席簿」** をアップロードすると、学籍番号順に並び替えられます。
+        1. **「コメントシート」** (複数可) をアップロードします。ZIPファイルにまとめたものでも大丈夫です。
+        2. (任意) **「出席簿」** をアップロードすると、学籍番号順に並び替えられます。(ZIPの中の出席簿も自動で使われます)
         3. サイドバーで **「対象年度」** を指定できます。
         4. **「集計開始」** ボタンを押すと、結果がダウンロードできます。
         """)
@@ -82,8 +92,8 @@ def main():
     # Step 1: Input Files
     st.subheader("1️⃣ コメントシート (必須)")
     uploaded_files = st.file_uploader(
-        "ここにExcelファイルを選択してください",
-        type=["xlsx", "xls"], 
+        "ここにExcelファイル (またはZIP) を選択してください",
+        type=["xlsx", "xls", "zip"], 
         accept_multiple_files=True,
         key="comments"
     )
@@ -108,69 +118,68 @@ def main():
             st.warning("⚠️ まずはコメントシートを選択してください。")
             return
 
-        # Create a temporary directory to store uploaded files
-        # because aggregator.py expects file paths, not file objects.
-        with tempfile.TemporaryDirectory() as temp_dir:
-            input_dir = os.path.join(temp_dir, "input")
-            os.makedirs(input_dir, exist_ok=True)
-            
-            # Progress Bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            status_text.text("📂 ファイルを読み込んでいます...")
-            
-            # Save Input Files
-            input_paths = []
-            for i, uploaded_file in enumerate(uploaded_files):
-                file_path = os.path.join(input_dir, uploaded_file.name)
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                input_paths.append(file_path)
-                progress_bar.progress((i + 1) / len(uploaded_files) * 0.3) # First 30%
-            
-            # Save Attendance File
-            attendance_path = None
-            if attendance_file:
-                attendance_path = os.path.join(temp_dir, attendance_file.name)
-                with open(attendance_path, "wb") as f:
-                    f.write(attendance_file.getbuffer())
-                status_text.text("📋 出席簿を処理中...")
-
-            # Define Output Path
-            output_filename = f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-            output_path = os.path.join(temp_dir, output_filename)
+        # Progress Bar
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+
+        # Uploads are parsed straight from memory (UploadedFile objects carry
+        # their name and bytes), and the summary comes back as a BytesIO.
+        if attendance_file:
+            status_text.text("📋 出席簿を処理中...")
+
+        output_filename = f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+        # Run Aggregation logic
+        status_text.text("⏳ 集計処理を実行中... (これには数秒かかる場合があります)")
+        progress_bar.progress(0.1)
+
+        def on_progress(event):
+            # Per-file progress between 10% and 90%
+            if event["event"] == "file":
+                progress_bar.progress(0.1 + 0.8 * event["index"] / event["total"])
+                status_text.text(f"⏳ 集計処理を実行中... ({event['index']}/{event['total']}) {event['file']}")
+            elif event["event"] == "stage_start" and event["stage"] == "write":
+                status_text.text("💾 結果を書き出しています...")
+            elif event["event"] == "report":
+                run_report.update(event["report"])
+
+        run_report = {}
+        
+        try:
+            # Run the actual aggregation
+            success, msg, output = process_buffers(uploaded_files, target_year, attendance_file,
+                                                  cache=get_parse_cache(), progress=on_progress)
             
-            # Run Aggregation logic
-            status_text.text("⏳ 集計処理を実行中... (これには数秒かかる場合があります)")
-            progress_bar.progress(0.6)
+            progress_bar.progress(1.0)
             
-            try:
-                # Run the actual aggregation
-                success, msg = process_files(input_paths, output_path, target_year, attendance_path)
-                
-                progress_bar.progress(1.0)
-                
-                if success and os.path.exists(output_path):
-                    status_text.success("✅ 集計完了！")
-                    st.balloons()
+            if success:
+                status_text.success("✅ 集計完了！")
+                st.balloons()
                     
-                    # Read the result file for download
-                    with open(output_path, "rb") as f:
-                        file_data = f.read()
-                        
-                    st.download_button(
-                        label="📥 結果をダウンロード (Download Result)",
-                        data=file_data,
-                        file_name=output_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        type="primary"
+                st.download_button(
+                    label="📥 結果をダウンロード (Download Result)",
+                    data=output,
+                    file_name=output_filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    type="primary"
+                )
+            else:
+                status_text.error(f"❌ エラー: {msg}")
+
+            if run_report:
+                with st.expander("📊 処理レポート (Run Report)", expanded=False):
+                    totals = run_report.get("totals", {})
+                    st.write(
+                        f"読み込み行数: {totals.get('rows_read', 0)} / "
+                        f"年度で抽出: {totals.get('rows_kept', 0)} / "
+                        f"名前で照合: {totals.get('fuzzy_hits', 0)} / "
+                        f"処理時間: {run_report.get('seconds', 0):.2f} 秒"
                     )
-                else:
-                    status_text.error(f"❌ エラー: {msg}")
-                    
-            except Exception as e:
-                status_text.error(f"❌ 予期せぬエラー: {e}")
+                    st.dataframe(pd.DataFrame.from_dict(run_report.get("stages", {}), orient="index"))
+                    st.dataframe(pd.DataFrame(run_report.get("files", [])))
+                
+        except Exception as e:
+            status_text.error(f"❌ 予期せぬエラー: {e}")
 
     # --- Footer ---
     st.markdown("---")
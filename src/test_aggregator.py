@@ -0,0 +1,240 @@
+import io
+import os
+import sys
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import aggregator
+
+# Parity tests for the summary workbook: small comment sheets with the cases the
+# assembly stage has to get right (IDs with typos matched by name, duplicate IDs
+# in the attendance sheet, tied Submission IDs, colored comment cells), checked
+# cell by cell against the output of the original pandas implementation.
+#   python -m pytest -q src/test_aggregator.py
+
+HEADER = ['ID', 'ColB', 'Course', 'ColD', 'フルネーム', 'Q00_学籍番号', 'Q01_コメントシート']
+YELLOW = "FFFFFF00"
+GREEN = "FF92D050"
+UNANSWERED_FILL = "00FFCCCC"
+
+SHEETS = {
+    "2025-04-07_comment_sheet.xlsx": [
+        [1, '', '2025_Lecture A', '', '佐藤 一郎', '25BB0001', 'first'],
+        [2, '', '2025_Lecture A', '', '鈴木 花子', '25BBOOO2', 'typo in the ID'], # matched by name
+        [3, '', '2024_Old Lecture', '', '山本 三郎', '24ZZ0009', 'last year'],
+        [4, '', '2025_Lecture A', '', 'Extra Student', 'X0099', 'not on the roster'],
+    ],
+    "2025-04-14_comment_sheet.xlsx": [
+        [5, '', '2025_Lecture A', '', '佐藤 一郎', '25BB0001', 'tie, first row'],
+        [5, '', '2025_Lecture A', '', '佐藤 一郎', '25BB0001', ('tie, later row wins', YELLOW)],
+        [7, '', '2025_Lecture A', '', '鈴木 花子', '25BB0002', ('latest', GREEN)],
+        [6, '', '2025_Lecture A', '', '鈴木花子', '', 'older, no ID'],
+        [8, '', '2025_Lecture A', '', 'Extra Student', 'x0099', 'second week'],
+    ],
+    "2025-04-21_comment_sheet.xlsx": [
+        [9, '', '2025_Lecture A', '', '', '', 'no name, no ID'], # dropped
+        [10, '', '2025_Lecture A', '', '佐藤　一郎', '25bb0001', ('full-width space', GREEN)],
+    ],
+}
+
+ROSTER = [
+    ('25BB0001', '佐藤 一郎'),
+    ('25BB0002', '鈴木 花子'),
+    ('25BB0001', '佐藤 一郎'), # duplicate ID: the student is listed twice
+    ('25BB0003', '田中 次郎'), # never submits
+]
+
+def write_comment_sheet(path, rows, write_only=True):
+    """
+    write_only=True stores <dimension ref="A1"> (like some exporters);
+    False is a normal workbook with the real sheet size.
+    """
+    wb = Workbook(write_only=write_only)
+    ws = wb.create_sheet() if write_only else wb.active
+    ws.append(HEADER)
+    for row in rows:
+        comment = row[-1]
+        if isinstance(comment, tuple):
+            text, color = comment
+            comment = WriteOnlyCell(ws, value=text)
+            comment.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        ws.append(row[:-1] + [comment])
+    wb.save(path)
+
+def write_roster(path, students):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for r in range(5):
+        ws.append([f"Header {r+1}"])
+    ws.append(['No', '学籍番号', '氏名'])
+    for i, (student_id, name) in enumerate(students, start=1):
+        ws.append([i, student_id, name])
+    wb.save(path)
+
+@pytest.fixture(params=[True, False], ids=["write-only", "normal"])
+def sheets(tmp_path, request):
+    paths = []
+    for name, rows in SHEETS.items():
+        path = tmp_path / name
+        write_comment_sheet(path, rows, write_only=request.param)
+        paths.append(str(path))
+    return paths
+
+@pytest.fixture
+def roster(tmp_path):
+    path = tmp_path / "KogibetuSeiseki_test.xlsx"
+    write_roster(path, ROSTER)
+    return str(path)
+
+def read_output(path):
+    """
+    [(value, solid fill color or None), ...] per row, and the column widths.
+    """
+    ws = load_workbook(path).active
+    rows = [[(c.value, c.fill.start_color.rgb if c.fill.patternType == 'solid' else None) for c in row]
+            for row in ws.iter_rows()]
+    widths = {letter: dim.width for letter, dim in ws.column_dimensions.items()}
+    return rows, widths
+
+def unanswered():
+    return (aggregator.UNANSWERED, UNANSWERED_FILL)
+
+HEADER_ROW = [('Name', None), ('ID', None), ('2025-04-07', None), ('2025-04-14', None), ('2025-04-21', None)]
+SATO = [('佐藤 一郎', None), ('25BB0001', None), ('first', None), ('tie, later row wins', YELLOW),
+        ('full-width space', GREEN)]
+TANAKA = [('田中 次郎', None), ('25BB0003', None), unanswered(), unanswered(), unanswered()]
+YAMAMOTO = [('山本 三郎', None), ('24ZZ0009', None), ('last year', None), unanswered(), unanswered()]
+HEADER_AS_STUDENT = [('フルネーム', None), ('Q00_学籍番号', None), ('Q01_コメントシート', None),
+                     ('Q01_コメントシート', None), ('Q01_コメントシート', None)]
+WIDTHS = {'A': 15.0, 'B': 10.0, 'C': 19.0, 'D': 21.0, 'E': 18.0}
+
+# With an attendance sheet: roster order (the duplicated student twice, the typo'd
+# ID merged by name), then the other students by NormID with their latest ID.
+WITH_ROSTER = [
+    HEADER_ROW,
+    SATO,
+    [('鈴木 花子', None), ('25BB0002', None), ('typo in the ID', None), ('latest', GREEN), unanswered()],
+    SATO,
+    TANAKA,
+]
+EXTRA_WITH_ROSTER = [('Extra Student', None), ('x0099', None), ('not on the roster', None), ('second week', None),
+                     unanswered()]
+
+# Without: every NormID sorted, Name / ID from the earliest submission
+NO_ROSTER = [
+    HEADER_ROW,
+    [('鈴木花子', None), (None, None), unanswered(), ('older, no ID', None), unanswered()],
+    SATO,
+    [('鈴木 花子', None), ('25BB0002', None), unanswered(), ('latest', GREEN), unanswered()],
+    [('鈴木 花子', None), ('25BBOOO2', None), ('typo in the ID', None), unanswered(), unanswered()],
+]
+EXTRA_NO_ROSTER = [('Extra Student', None), ('X0099', None), ('not on the roster', None), ('second week', None),
+                   unanswered()]
+
+EXPECTED = {
+    (True, "2025"): WITH_ROSTER + [EXTRA_WITH_ROSTER],
+    (True, None): WITH_ROSTER + [YAMAMOTO, HEADER_AS_STUDENT, EXTRA_WITH_ROSTER],
+    (False, "2025"): NO_ROSTER + [EXTRA_NO_ROSTER],
+    (False, None): NO_ROSTER[:2] + [YAMAMOTO] + NO_ROSTER[2:] + [HEADER_AS_STUDENT, EXTRA_NO_ROSTER],
+}
+
+@pytest.mark.parametrize("with_roster,year", list(EXPECTED))
+def test_summary_matches_expected(tmp_path, sheets, roster, with_roster, year):
+    output = tmp_path / "summary.xlsx"
+    success, message = aggregator.process_files(sheets, str(output), year, roster if with_roster else None, workers=1)
+    assert success, message
+    rows, widths = read_output(output)
+    assert rows == EXPECTED[(with_roster, year)]
+    assert widths == WIDTHS
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_readers_agree(tmp_path, sheets, roster, streaming):
+    output = tmp_path / "summary.xlsx"
+    success, message = aggregator.process_files(sheets, str(output), "2025", roster, workers=1, streaming=streaming)
+    assert success, message
+    assert read_output(output) == (EXPECTED[(True, "2025")], WIDTHS)
+
+def test_file_order_does_not_matter(tmp_path, sheets, roster):
+    output = tmp_path / "summary.xlsx"
+    success, message = aggregator.process_files(sheets[::-1], str(output), "2025", roster, workers=1)
+    assert success, message
+    assert read_output(output) == (EXPECTED[(True, "2025")], WIDTHS)
+
+def test_buffers_match_files(sheets, roster):
+    def buffer(path):
+        with open(path, "rb") as f:
+            return os.path.basename(path), f.read()
+    success, message, data = aggregator.process_buffers([buffer(p) for p in sheets], "2025", buffer(roster))
+    assert success, message
+    assert read_output(data) == (EXPECTED[(True, "2025")], WIDTHS)
+
+def test_streaming_reader_never_reloads(monkeypatch, sheets):
+    modes = []
+    def load_workbook_spy(*args, **kwargs):
+        modes.append(kwargs.get("read_only"))
+        return load_workbook(*args, **kwargs)
+    expected = [aggregator._read_comment_rows(path, streaming=False) for path in sheets]
+    monkeypatch.setattr(aggregator, "load_workbook", load_workbook_spy)
+    assert [aggregator._read_comment_rows(path) for path in sheets] == expected
+    assert modes == [True] * len(sheets)
+
+@pytest.mark.parametrize("write_only", [True, False])
+def test_narrow_sheet_has_no_rows(tmp_path, write_only):
+    # Six columns (no comment column): both readers skip the whole sheet
+    path = tmp_path / "2025-04-07_narrow.xlsx"
+    wb = Workbook(write_only=write_only)
+    ws = wb.create_sheet() if write_only else wb.active
+    ws.append([1, '', '2025_Lecture A', '', '佐藤 一郎', '25BB0001'])
+    wb.save(path)
+    assert aggregator._read_comment_rows(str(path)) == []
+    assert aggregator._read_comment_rows(str(path), streaming=False) == []
+
+def test_to_frame_matches_records(sheets, roster):
+    accumulator = aggregator.Pipeline(workers=1).aggregate(sheets, None, roster).submissions
+    # A replaced comment and a removed date leave garbage slots behind
+    accumulator.add('25bb0003', '2025-04-07', 1.0, '田中 次郎', '25BB0003', 'old')
+    accumulator.add('25bb0003', '2025-04-07', 2.0, '田中 次郎', '25BB0003', 'new', YELLOW, '2025_Lecture A')
+    accumulator.remove_dates(['2025-04-21'])
+    frame = accumulator.to_frame()
+
+    categoricals = ["NormID", "ID", "Name", "Date", "Color", "Course"]
+    assert list(frame.columns) == ["NormID", "ID", "Name", "Date", "SubmissionID", "Comment", "Color", "Course"]
+    assert all(isinstance(frame[c].dtype, pd.CategoricalDtype) for c in categoricals)
+    assert frame["SubmissionID"].dtype == "float64"
+
+    def value(v):
+        return None if pd.isna(v) else v
+    rows = [tuple(value(v) for v in row) for row in
+            frame[["NormID", "Date", "SubmissionID", "Name", "ID", "Comment", "Color", "Course"]].itertuples(index=False)]
+    assert rows == [tuple(record) for record in accumulator.records()]
+    assert ('25bb0003', '2025-04-07', 2.0, '田中 次郎', '25BB0003', 'new', YELLOW, '2025_Lecture A') in rows
+    assert '2025-04-21' not in set(frame["Date"])
+
+@pytest.mark.parametrize("use_cache", [False, True])
+def test_rows_read_includes_rows_the_year_filter_drops(sheets, roster, use_cache):
+    from parse_cache import MemoryParseCache
+    files = []
+    pipeline = aggregator.Pipeline(workers=1, cache=MemoryParseCache() if use_cache else None)
+    pipeline.run(sheets, io.BytesIO(), "2025", roster, progress=lambda e: files.append(e) if e["event"] == "file" else None)
+    # header row + 4 rows, the header and the 2024 row fail the year filter
+    assert (files[0]["rows_read"], files[0]["rows_kept"]) == (5, 3)
+    totals = pipeline.last_report["totals"]
+    assert (totals["rows_read"], totals["rows_kept"]) == (13, 9)
+
+def test_cache_is_shared_across_years(capsys, sheets, roster):
+    from parse_cache import MemoryParseCache
+    cache = MemoryParseCache()
+    for year in ("2025", "2024", None, "2025"):
+        success, message = aggregator.process_files(sheets, io.BytesIO(), year, roster, workers=1, cache=cache)
+        assert success, message
+    reused = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Parse cache:")]
+    assert reused == ["Parse cache: 0 of 3 files reused."] + ["Parse cache: 3 of 3 files reused."] * 3
+
+def test_invalid_course_regex_is_a_value_error():
+    with pytest.raises(ValueError):
+        aggregator.FilterSpec(course_regex="(")
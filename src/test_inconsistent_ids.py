@@ -1,50 +1,57 @@
-import pandas as pd
 import os
+import sys
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
 
-INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'input')
-os.makedirs(INPUT_DIR, exist_ok=True)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import aggregator
 
 # Test Case: Inconsistent IDs for "Sato Jo"
-# File 1: 2023-10-01 (ID: 25BB0214)
-# File 2: 2023-10-02 (ID: 25BB0215) - Typo in ID
-# We expect ONE row for "Sato Jo" in the output, and the ID should probably be 25BB0215 (latest)
-
-data1 = pd.DataFrame({
-    'ColA': ['', ''], 'ColB': ['', ''], 'ColC': ['', ''], 'ColD': ['', ''],
-    'Name': ['Sato Jo', 'Tanaka'],
-    'ID': ['25BB0214', '111111'],
-    'Comment': ['Comment 1', 'Comment T1']
-})
-data1.to_excel(os.path.join(INPUT_DIR, '2023-10-01_submit.xlsx'), header=True, index=False)
-
-data2 = pd.DataFrame({
-    'ColA': ['', ''], 'ColB': ['', ''], 'ColC': ['', ''], 'ColD': ['', ''],
-    'Name': ['Sato Jo', 'Tanaka'],
-    'ID': ['25BB0215', '111111'], # CHANGED ID for Sato Jo
-    'Comment': ['Comment 2', 'Comment T2']
-})
-data2.to_excel(os.path.join(INPUT_DIR, '2023-10-02_submit.xlsx'), header=True, index=False)
-
-# Add a student who only submitted on day 1 (to test "未回答")
-data3 = pd.DataFrame({
-    'ColA': [''], 'ColB': [''], 'ColC': [''], 'ColD': [''],
-    'Name': ['Suzuki'],
-    'ID': ['333333'],
-    'Comment': ['Comment S1']
-})
-# Append to day 1 file
-with pd.ExcelWriter(os.path.join(INPUT_DIR, '2023-10-01_submit.xlsx'), mode='a', if_sheet_exists='overlay') as writer:
-    # This is complex to append row without messing up.
-    # Easire to just rewrite day 1 with 3 students.
-    pass
-
-# Rewrite Day 1 with 3 students
-data1_v2 = pd.DataFrame({
-    'ColA': ['', '', ''], 'ColB': ['', '', ''], 'ColC': ['', '', ''], 'ColD': ['', '', ''],
-    'Name': ['Sato Jo', 'Tanaka', 'Suzuki'],
-    'ID': ['25BB0214', '111111', '333333'],
-    'Comment': ['Comment 1', 'Comment T1', 'Comment S1']
-})
-data1_v2.to_excel(os.path.join(INPUT_DIR, '2023-10-01_submit.xlsx'), header=True, index=False)
-
-print("Test data created.")
+# File 1: 2023-10-01 (ID: 25BB0214) - Typo in ID
+# File 2: 2023-10-02 (ID: 25BB0215)
+# The attendance sheet lists Sato Jo as 25BB0215, so the typo is matched by name
+# and we expect ONE row for "Sato Jo" with both comments.
+# Suzuki only submitted on day 1, so day 2 is "未回答".
+
+def write_sheet(path, names, ids, comments):
+    n = len(names)
+    pd.DataFrame({
+        'ColA': [''] * n, 'ColB': [''] * n, 'ColC': [''] * n, 'ColD': [''] * n,
+        'Name': names,
+        'ID': ids,
+        'Comment': comments,
+    }).to_excel(path, header=True, index=False)
+
+def write_attendance(path, students):
+    wb = Workbook()
+    ws = wb.active
+    for r in range(5):
+        ws.append([f"Header {r+1}"])
+    ws.append(['No', '学籍番号', '氏名'])
+    for i, (student_id, name) in enumerate(students, start=1):
+        ws.append([i, student_id, name])
+    wb.save(path)
+
+def test_inconsistent_ids(tmp_path):
+    day1 = tmp_path / '2023-10-01_submit.xlsx'
+    day2 = tmp_path / '2023-10-02_submit.xlsx'
+    attendance = tmp_path / 'KogibetuSeiseki_test.xlsx'
+    write_sheet(day1, ['Sato Jo', 'Tanaka', 'Suzuki'], ['25BB0214', '111111', '333333'],
+                ['Comment 1', 'Comment T1', 'Comment S1'])
+    write_sheet(day2, ['Sato Jo', 'Tanaka'], ['25BB0215', '111111'], ['Comment 2', 'Comment T2'])
+    write_attendance(attendance, [('25BB0215', 'Sato Jo'), ('111111', 'Tanaka'), ('333333', 'Suzuki')])
+
+    output = tmp_path / 'summary.xlsx'
+    success, message = aggregator.process_files([str(day1), str(day2)], str(output), None, str(attendance), workers=1)
+    assert success, message
+
+    rows = list(load_workbook(output).active.iter_rows(values_only=True))
+    assert rows[0] == ('Name', 'ID', '2023-10-01', '2023-10-02')
+    assert [r for r in rows if r[0] == 'Sato Jo'] == [('Sato Jo', '25BB0215', 'Comment 1', 'Comment 2')]
+    # Attendance order first (the sheets' header row follows as an extra "student")
+    assert rows[1:4] == [
+        ('Sato Jo', '25BB0215', 'Comment 1', 'Comment 2'),
+        ('Tanaka', '111111', 'Comment T1', 'Comment T2'),
+        ('Suzuki', '333333', 'Comment S1', aggregator.UNANSWERED),
+    ]
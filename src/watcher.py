@@ -0,0 +1,232 @@
+import os
+import sys
+import time
+import argparse
+
+import aggregator
+import parse_cache
+from aggregator import ATTENDANCE_PREFIX, SHEET_EXTENSIONS
+from export import is_export_file, write_export
+
+# ==============================================================================
+# Watch mode (フォルダ監視)
+# Watches a folder of daily comment sheets and keeps the summary up to date.
+# The folder is polled (file mtime + size, no external services). Only new or
+# modified sheets are parsed and merged into the in-memory state, and the summary
+# is rewritten once the folder has been quiet for a few seconds (debounce).
+#
+#   python src/watcher.py INPUT_DIR summary.xlsx --year 2025
+# ==============================================================================
+
+class IncrementalAggregation:
+    """
+    Aggregation state that can be updated one file at a time.
+    Keeps each file's raw rows and its own SubmissionAccumulator; the merged
+    accumulator is rebuilt only for the dates of the files that changed.
+    Files are merged in sorted path order, so the result equals a full run
+    over the sorted file list.
+    """
+
+    def __init__(self, target_year=None, cache=None):
+        self.spec = aggregator.FilterSpec.coerce(target_year)
+        self.cache = cache
+        self.roster = aggregator.Roster()
+        self.sheets = {}     # path -> (date, rows)
+        self.file_subs = {}  # path -> SubmissionAccumulator of that file only
+        self.merged = aggregator.SubmissionAccumulator()
+
+    def set_roster(self, attendance_file):
+        """
+        Loads (or clears, with None) the attendance sheet. Every file is re-matched,
+        from the kept rows, since matching depends on the roster.
+        Raises AggregationError if the sheet cannot be used.
+        """
+        self.roster = aggregator.load_roster(attendance_file, self.cache) if attendance_file else aggregator.Roster()
+        for path in self.sheets:
+            self.file_subs[path] = self._deduplicate(path)
+        self._rebuild(self.dates())
+
+    def update_files(self, paths):
+        """
+        Parses new / modified files and merges them. Files outside the date range
+        are ignored. Raises AggregationError if a file cannot be read (the state is left unchanged).
+        """
+        paths = [p for p in paths if self.spec.accepts_date(aggregator._date_from_filename(p))]
+        parsed = list(aggregator.read_sheets(paths, workers=1, cache=self.cache))
+        dates = set()
+        for path, date, rows in parsed:
+            if path in self.sheets:
+                dates.add(self.sheets[path][0])
+            self.sheets[path] = (date, rows)
+            self.file_subs[path] = self._deduplicate(path)
+            dates.add(date)
+        self._rebuild(dates)
+
+    def remove_files(self, paths):
+        dates = set()
+        for path in paths:
+            if path in self.sheets:
+                dates.add(self.sheets.pop(path)[0])
+                self.file_subs.pop(path)
+        self._rebuild(dates)
+
+    def dates(self):
+        return {date for date, _ in self.sheets.values()}
+
+    def _deduplicate(self, path):
+        date, rows = self.sheets[path]
+        records = aggregator.normalize_records([(path, date, rows)], self.roster, self.spec)
+        return aggregator.deduplicate(records)
+
+    def _rebuild(self, dates):
+        """
+        Recomputes the merged submissions of the given dates from the per-file accumulators.
+        """
+        if not dates:
+            return
+        self.merged.remove_dates(dates)
+        for path in sorted(p for p, (date, _) in self.sheets.items() if date in dates):
+            for record in self.file_subs[path].records():
+                self.merged.add(*record)
+        # Replaced and removed submissions stay in the packed columns until compacted
+        if len(self.merged.sub_ids) > 2 * len(self.merged) + 1000:
+            self.merged.compact()
+
+    def table(self):
+        return aggregator.build_summary(self.merged, self.roster)
+
+def scan(folder, output_file):
+    """
+    Returns ({comment sheet path: (mtime, size)}, attendance sheet path or None).
+    """
+    sheets = {}
+    rosters = []
+    output_file = os.path.abspath(output_file)
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if not name.lower().endswith(SHEET_EXTENSIONS) or name.startswith("~$") or os.path.abspath(path) == output_file:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue # removed while scanning
+        if name.startswith(ATTENDANCE_PREFIX):
+            rosters.append(path)
+        else:
+            sheets[path] = (st.st_mtime, st.st_size)
+    return sheets, (rosters[0] if rosters else None)
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime, st.st_size)
+    except OSError:
+        return None
+
+def watch(folder, output_file, target_year=None, attendance_file=None, interval=2.0, debounce=5.0,
+          once=False, cache=None):
+    """
+    Polls folder every `interval` seconds. Changes are applied once nothing has
+    changed for `debounce` seconds (so files still being copied are not read),
+    then the summary is rewritten. attendance_file=None uses the folder's
+    KogibetuSeiseki_ file if there is one. once=True processes the folder once and returns.
+    """
+    state = IncrementalAggregation(target_year, cache)
+    writer = write_export if is_export_file(output_file) else aggregator.write_summary
+
+    applied = {}            # path -> (mtime, size) merged into state
+    applied_roster = None   # (path, signature) of the loaded attendance sheet
+    failed = {}             # path / roster -> signature that could not be read (retried once it changes)
+    dirty = False           # state changed but the summary is not written yet
+    last_seen = None
+    last_change = 0.0
+
+    print(f"Watching {folder} -> {output_file} (Ctrl+C to stop)")
+    while True:
+        sheets, found_roster = scan(folder, output_file)
+        roster_path = attendance_file or found_roster
+        roster = (roster_path, _signature(roster_path)) if roster_path else None
+        snapshot = (sheets, roster)
+        if snapshot != last_seen:
+            last_seen = snapshot
+            last_change = time.monotonic()
+
+        if time.monotonic() - last_change >= debounce or once:
+            stamp = time.strftime('%H:%M:%S')
+            changed = [p for p, sig in sheets.items() if applied.get(p) != sig and failed.get(p) != sig]
+            removed = [p for p in applied if p not in sheets]
+            reload_roster = roster != applied_roster and failed.get("roster") != roster
+
+            if changed or removed or reload_roster:
+                start = time.perf_counter()
+                state.remove_files(removed)
+                for p in removed:
+                    del applied[p]
+                dirty = dirty or bool(removed)
+
+                if reload_roster:
+                    try:
+                        state.set_roster(roster_path)
+                        applied_roster = roster
+                        dirty = True
+                    except aggregator.AggregationError as e:
+                        print(f"[{stamp}] Attendance sheet not loaded: {e}")
+                        failed["roster"] = roster
+
+                # One file at a time, so a sheet that is still being written does not hold back the others
+                updated = 0
+                for p in changed:
+                    try:
+                        state.update_files([p])
+                    except aggregator.AggregationError as e:
+                        print(f"[{stamp}] Skipped until it changes again: {e}")
+                        failed[p] = sheets[p]
+                        continue
+                    applied[p] = sheets[p]
+                    updated += 1
+                dirty = dirty or updated > 0
+
+                print(f"[{stamp}] {updated} new/changed, {len(removed)} removed: "
+                      f"{len(state.sheets)} files, {len(state.merged)} submissions ({time.perf_counter() - start:.2f} s)")
+
+            if dirty:
+                start = time.perf_counter()
+                try:
+                    writer(output_file, state.table())
+                    dirty = False
+                    print(f"[{stamp}] Saved {output_file} ({time.perf_counter() - start:.2f} s)")
+                except PermissionError:
+                    print(f"[{stamp}] Permission denied: {output_file}. Close it; retrying.")
+                    last_change = time.monotonic()
+
+            if once:
+                return
+
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep a summary up to date as comment sheets arrive / フォルダ監視")
+    parser.add_argument("folder", help="Folder the daily comment sheets are saved to")
+    parser.add_argument("output", help="Summary file (.xlsx, .csv, .parquet, .feather)")
+    parser.add_argument("--attendance", default=None, help="Attendance sheet (default: KogibetuSeiseki_ file in the folder)")
+    parser.add_argument("--year", default=None, help="Target year filter (Column C)")
+    parser.add_argument("--course-prefix", default=None, help="Only rows whose Column C starts with this")
+    parser.add_argument("--course-regex", default=None, help="Only rows whose Column C matches this regular expression")
+    parser.add_argument("--from", dest="date_from", default=None, help="First date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--to", dest="date_to", default=None, help="Last date to include (YYYY-MM-DD, from the filename)")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between folder scans")
+    parser.add_argument("--debounce", type=float, default=5.0, help="Quiet seconds before the summary is rewritten")
+    parser.add_argument("--once", action="store_true", help="Update once and exit")
+    parser.add_argument("--cache", action="store_true", help="Also keep parsed sheets in the per-user parse cache")
+    args = parser.parse_args()
+    try:
+        spec = aggregator.FilterSpec(args.year, args.course_prefix, args.course_regex, args.date_from, args.date_to)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        watch(args.folder, args.output, spec, args.attendance, args.interval, args.debounce,
+              args.once, parse_cache.ParseCache() if args.cache else None)
+    except KeyboardInterrupt:
+        print("Stopped.")
+        sys.exit(0)